@@ -0,0 +1,30 @@
+"""
+JSON helpers shared by the runner, the tool parser and the tools.
+
+orjson is used when it's installed; the stdlib json module is the fallback.
+"""
+
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # orjson is optional; stdlib json is the fallback
+
+# orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers catch either
+json_loads = orjson.loads if orjson is not None else json.loads
+
+
+def dump_pretty(obj: Any) -> bytes:
+    """Serialize obj as 2-space indented UTF-8 JSON."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+
+
+def dumps_sorted(obj: Any) -> Any:
+    """Compact JSON with sorted keys, for comparing values; str or bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'), default=str)
@@ -4,10 +4,12 @@ Ralph Ollama Runner - Autonomous AI agent loop using Ollama models.
 """
 
 import argparse
-import json
+import asyncio
+import itertools
 import os
 import sys
 from pathlib import Path
+from types import SimpleNamespace
 
 # Load environment variables from .env file if present
 try:
@@ -17,14 +19,40 @@ except ImportError:
     pass  # python-dotenv is optional
 
 try:
-    from openai import OpenAI
+    import httpx
+    from openai import AsyncOpenAI
 except ImportError:
-    print("Error: openai package not installed.", file=sys.stderr)
+    print("Error: openai/httpx packages not installed.", file=sys.stderr)
     print("Run: pip install -r requirements.txt", file=sys.stderr)
     sys.exit(1)
 
-from tools import TOOL_SCHEMAS, ToolExecutor
-from tool_parser import extract_tool_calls, deduplicate_tool_calls, has_progress_markers
+from json_utils import dump_pretty
+from tools import READ_ONLY_TOOLS, TOOL_SCHEMAS, ToolExecutor
+from tool_parser import (
+    extract_tool_calls, deduplicate_tool_calls, has_progress_markers,
+    scan_streamed_tool_calls, call_signature
+)
+
+
+# Upper bound on tool calls running at once when the model fans out wide
+TOOL_CONCURRENCY = max(1, int(os.getenv("RALPH_TOOL_CONCURRENCY", "8")))
+
+
+def tool_log(tool_name: str, arguments, result: str) -> bytes:
+    """Format one executed tool call, with an abbreviated result, for stderr."""
+    result_preview = result[:200] + "..." if len(result) > 200 else result
+    return b"".join((
+        "  → ".encode("utf-8"), tool_name.encode("utf-8"),
+        b"(", dump_pretty(arguments), b")\n",
+        f"     ✓ {result_preview}\n".encode("utf-8", "replace")
+    ))
+
+
+def write_stderr(data: bytes) -> None:
+    """Write pre-encoded bytes to stderr, keeping order with print() output."""
+    sys.stderr.flush()
+    sys.stderr.buffer.write(data)
+    sys.stderr.buffer.flush()
 
 
 def load_prompt(script_dir: Path, prompt_file: str = None) -> str:
@@ -38,10 +66,161 @@ def load_prompt(script_dir: Path, prompt_file: str = None) -> str:
     
     if not prompt_path.exists():
         raise FileNotFoundError(f"Prompt file not found at {prompt_path}")
-    return prompt_path.read_text()
+    return prompt_path.read_text(encoding="utf-8")
+
+
+def build_http_client() -> httpx.AsyncClient:
+    """
+    Build the shared HTTP client used for every Ollama request.
+    
+    One pooled client serves both the OpenAI-compatible endpoint and the
+    native /api endpoints. HTTP/2 is enabled when the optional h2 package
+    is installed so concurrent requests multiplex over a single socket.
+    """
+    try:
+        import h2  # noqa: F401
+        http2 = True
+    except ImportError:
+        http2 = False
+    
+    transport = httpx.AsyncHTTPTransport(retries=3, http2=http2)
+    return httpx.AsyncClient(
+        transport=transport,
+        timeout=httpx.Timeout(300.0, connect=10.0),
+        limits=httpx.Limits(
+            max_keepalive_connections=40,
+            max_connections=100,
+            keepalive_expiry=30.0
+        )
+    )
+
 
+def parse_keep_alive(value: str):
+    """Convert a keep_alive setting to what Ollama expects (seconds or a duration)."""
+    if value.lstrip("-").isdigit():
+        return int(value)
+    return value
 
-def health_check(host: str, model: str) -> int:
+
+async def warmup_model(host: str, model: str, http_client: httpx.AsyncClient, keep_alive) -> None:
+    """
+    Load the model into memory and open the connection pool before the first turn.
+    
+    An empty /api/generate prompt makes Ollama load the weights without
+    generating anything. Failures are reported but never fatal.
+    """
+    try:
+        response = await http_client.post(
+            f"{host}/api/generate",
+            json={"model": model, "prompt": "", "keep_alive": keep_alive}
+        )
+        response.raise_for_status()
+    except Exception as e:
+        print(f"⚠️  Model warmup failed: {e}", file=sys.stderr)
+
+
+async def stream_completion(stream, on_tool_call=None) -> SimpleNamespace:
+    """
+    Consume a streamed chat completion and rebuild the final message.
+    
+    Text content is scanned for complete JSON tool calls as it arrives and
+    each new one is handed to ``on_tool_call`` so it can start running while
+    the model is still generating. Structured tool calls are reassembled
+    from their deltas and only become available once the stream ends.
+    """
+    content = ""
+    scan_pos = 0
+    structured = {}
+    
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        
+        for tc in delta.tool_calls or []:
+            entry = structured.setdefault(tc.index, {"id": None, "name": "", "arguments": ""})
+            if tc.id:
+                entry["id"] = tc.id
+            if tc.function:
+                entry["name"] += tc.function.name or ""
+                entry["arguments"] += tc.function.arguments or ""
+        
+        if delta.content:
+            content += delta.content
+            if on_tool_call and not structured:
+                calls, scan_pos = scan_streamed_tool_calls(content, scan_pos)
+                for call in calls:
+                    on_tool_call(call)
+    
+    tool_calls = [
+        SimpleNamespace(
+            id=entry["id"] or f"call_{index}",
+            type="function",
+            function=SimpleNamespace(name=entry["name"], arguments=entry["arguments"] or "{}")
+        )
+        for index, entry in sorted(structured.items())
+    ]
+    return SimpleNamespace(role="assistant", content=content, tool_calls=tool_calls or None)
+
+
+COMPACTED_PREFIX = "TOOL RESULT SUMMARY"
+
+# Characters of each old message sent to the summarizer, so the transcript
+# stays within the model's context however large the tool results were
+COMPACT_MESSAGE_CHARS = 2000
+
+
+async def compact_messages(client: AsyncOpenAI, model: str, messages: list,
+                           keep_recent: int, keep_alive) -> bool:
+    """
+    Fold old steps into a single summary message to bound prompt growth.
+    
+    Everything between the opening system/user pair and the last
+    ``keep_recent`` messages (including any earlier summary) is summarized
+    with one extra LLM call and replaced by one user message, so the
+    history really shrinks. The cut never separates an assistant message
+    from its tool results. Callers compact only once the history has grown
+    well past ``keep_recent``, so the rewritten prefix, and Ollama's KV
+    cache for it, stays stable for many steps in between.
+    
+    Returns False if the summary call failed and nothing was compacted.
+    """
+    cut = len(messages) - keep_recent
+    while cut > 2 and messages[cut].get("role") == "tool":
+        cut -= 1
+    old = messages[2:cut]
+    if len(old) < 2:
+        return True
+    
+    transcript = "\n\n".join(
+        msg["content"][:COMPACT_MESSAGE_CHARS] for msg in old if msg.get("content")
+    )
+    try:
+        response = await client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": "Summarize these steps and tool results for an agent "
+                                              "that will continue the task. Keep file paths, errors, "
+                                              "and decisions. Be concise."},
+                {"role": "user", "content": transcript}
+            ],
+            max_tokens=512,
+            temperature=0,
+            extra_body={"keep_alive": keep_alive}
+        )
+        summary = response.choices[0].message.content or ""
+    except Exception as e:
+        print(f"\n⚠️  Message compaction failed: {e}", file=sys.stderr)
+        return False
+    
+    messages[2:cut] = [{"role": "user", "content": f"{COMPACTED_PREFIX} (prior steps):\n{summary}"}]
+    
+    print(f"\n🗜️  Compacted {len(old)} old message(s)", file=sys.stderr)
+    return True
+
+
+async def health_check(host: str, model: str, http_client: httpx.AsyncClient,
+                       keep_alive: str = "30m") -> int:
     """Run health check to verify Ollama setup."""
     print("🔍 Ralph Ollama Health Check")
     print("━" * 60)
@@ -50,8 +229,8 @@ def health_check(host: str, model: str) -> int:
     # Check 1: Ollama connectivity
     print(f"1️⃣  Checking Ollama connectivity ({host})...")
     try:
-        import requests
-        response = requests.get(f"{host}/api/tags", timeout=5)
+        # /api/tags answers both the connectivity and the model check
+        response = await http_client.get(f"{host}/api/tags", timeout=5)
         if response.status_code == 200:
             print("   ✅ Ollama is reachable")
         else:
@@ -69,11 +248,12 @@ def health_check(host: str, model: str) -> int:
     # Check 2: Model availability
     print(f"2️⃣  Checking for model '{model}'...")
     try:
-        response = requests.get(f"{host}/api/tags", timeout=5)
         data = response.json()
         models = [m.get("name", "") for m in data.get("models", [])]
         
-        if model in models or any(m.startswith(model) for m in models):
+        # Exact name, or the bare name of a tagged model ("llama3.1" -> "llama3.1:latest")
+        tag_prefix = f"{model}:"
+        if model in set(models) or any(m.startswith(tag_prefix) for m in models):
             print(f"   ✅ Model '{model}' is available")
         else:
             print(f"   ❌ Model '{model}' not found")
@@ -93,11 +273,12 @@ def health_check(host: str, model: str) -> int:
     # Check 3: Simple chat test
     print("3️⃣  Testing basic chat completion...")
     try:
-        client = OpenAI(base_url=f"{host}/v1", api_key="ollama")
-        response = client.chat.completions.create(
+        client = AsyncOpenAI(base_url=f"{host}/v1", api_key="ollama", http_client=http_client)
+        response = await client.chat.completions.create(
             model=model,
             messages=[{"role": "user", "content": "Say 'test' and nothing else"}],
-            max_tokens=10
+            max_tokens=10,
+            extra_body={"keep_alive": parse_keep_alive(keep_alive)}
         )
         if response.choices:
             print("   ✅ Chat completion successful")
@@ -119,7 +300,7 @@ def health_check(host: str, model: str) -> int:
     return 0
 
 
-def main():
+async def main():
     parser = argparse.ArgumentParser(
         description="Ralph Ollama Runner - Execute PRD tasks using Ollama models"
     )
@@ -143,6 +324,43 @@ def main():
         help="Maximum tool steps per iteration (default: 50 or RALPH_MAX_TOOL_STEPS env var)"
     )
     
+    parser.add_argument(
+        "--keep-alive",
+        default=os.getenv("RALPH_KEEP_ALIVE", "30m"),
+        help="How long Ollama keeps the model loaded, e.g. 30m or -1 for forever "
+             "(default: 30m or RALPH_KEEP_ALIVE env var)"
+    )
+    
+    parser.add_argument(
+        "--compact-after",
+        type=int,
+        default=int(os.getenv("RALPH_COMPACT_AFTER", "40")),
+        help="Summarize old steps once the conversation exceeds this many messages, "
+             "keeping the newest half, 0 to disable (default: 40 or RALPH_COMPACT_AFTER env var)"
+    )
+    
+    parser.add_argument(
+        "--stream",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Stream responses and start text tool calls before generation ends (default: on)"
+    )
+    
+    parser.add_argument(
+        "--warmup",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Pre-load the model before the first request (default: on)"
+    )
+    
+    parser.add_argument(
+        "--persistent-shell",
+        action=argparse.BooleanOptionalAction,
+        default=os.getenv("RALPH_PERSISTENT_SHELL", "0").lower() in ("1", "true", "yes"),
+        help="Reuse one bash process for run_cmd shell commands "
+             "(default: off or RALPH_PERSISTENT_SHELL env var)"
+    )
+    
     parser.add_argument(
         "--health",
         action="store_true",
@@ -157,10 +375,20 @@ def main():
     
     args = parser.parse_args()
     
-    # Run health check if requested
-    if args.health:
-        return health_check(args.host, args.model)
-    
+    # A single connection pool is shared by the health check and the agent loop
+    http_client = build_http_client()
+    try:
+        # Run health check if requested
+        if args.health:
+            return await health_check(args.host, args.model, http_client, args.keep_alive)
+        
+        return await run_agent(args, http_client)
+    finally:
+        await http_client.aclose()
+
+
+async def run_agent(args: argparse.Namespace, http_client: httpx.AsyncClient) -> int:
+    """Run the tool-calling loop for one Ralph iteration."""
     # Get script directory (workspace root)
     script_dir = Path(__file__).parent.resolve()
     
@@ -172,14 +400,22 @@ def main():
         return 1
     
     # Initialize tool executor
-    tool_executor = ToolExecutor(script_dir)
+    tool_executor = ToolExecutor(script_dir, persistent_shell=args.persistent_shell,
+                                 max_concurrency=TOOL_CONCURRENCY)
     
     # Initialize OpenAI client with Ollama base URL
-    client = OpenAI(
+    client = AsyncOpenAI(
         base_url=f"{args.host}/v1",
-        api_key="ollama"  # Ollama doesn't require a real API key
+        api_key="ollama",  # Ollama doesn't require a real API key
+        http_client=http_client
     )
     
+    # Keep the model resident in Ollama between tool steps
+    keep_alive = parse_keep_alive(args.keep_alive)
+    
+    if args.warmup:
+        await warmup_model(args.host, args.model, http_client, keep_alive)
+    
     # Prepare messages
     messages = [
         {"role": "system", "content": system_prompt},
@@ -189,19 +425,78 @@ def main():
     # Tool calling loop with deduplication
     step_count = 0
     recent_tool_calls = []  # Track recent calls to prevent loops
+    native_tool_calls = False  # Set once the model answers with structured tool calls
+    compact_retry_at = 0  # History length a failed compaction waits for
+    
+    async def run_one(tool_call):
+        """
+        Run a single tool call without blocking the event loop.
+        
+        Returns (result, log) where log is the call's stderr output, so that
+        concurrent calls can be logged in order with a single write.
+        """
+        tool_name = tool_call.name
+        arguments = tool_call.arguments
+        
+        # Execute the tool off the event loop, bounded by the executor
+        result = await tool_executor.execute_async(tool_name, arguments)
+        return result, tool_log(tool_name, arguments, result)
+    
+    async def run_batch(calls):
+        """Run the calls that weren't started while streaming as one executor batch."""
+        results = await tool_executor.execute_batch([(tc.name, tc.arguments) for tc in calls])
+        return [
+            (result, tool_log(tc.name, tc.arguments, result))
+            for tc, result in zip(calls, results)
+        ]
     
     while step_count < args.max_steps:
         # Make the API call with tools
         try:
-            response = client.chat.completions.create(
+            # Compacting down to half the threshold leaves room for many
+            # steps before the next summary call rewrites the prefix; after a
+            # failed summary, wait for keep_recent more messages to retry
+            if args.compact_after and len(messages) > max(args.compact_after, compact_retry_at):
+                keep_recent = args.compact_after // 2
+                if not await compact_messages(client, args.model, messages, keep_recent, keep_alive):
+                    compact_retry_at = len(messages) + keep_recent
+            
+            # Tools ride in extra_body so the SDK doesn't re-walk the
+            # constant schema through its type transform on every request
+            response = await client.chat.completions.create(
                 model=args.model,
                 messages=messages,
-                tools=TOOL_SCHEMAS,
-                temperature=0.7
+                temperature=0.7,
+                stream=args.stream,
+                extra_body={"tools": TOOL_SCHEMAS, "keep_alive": keep_alive}
             )
             
-            message = response.choices[0].message
+            # Read-only text tool calls that complete mid-stream start running
+            # immediately, up to the first call that could change anything
+            speculative = {}
+            
+            # Text calls are ignored when a response also carries structured
+            # ones, so a model that has used those gets no text speculation
+            if args.stream and not native_tool_calls:
+                recent_signatures = {call_signature(n, a) for n, a in recent_tool_calls[-3:]}
+                saw_write = False
+                
+                def start_early(call):
+                    nonlocal saw_write
+                    saw_write = saw_write or call.name not in READ_ONLY_TOOLS
+                    if saw_write:
+                        return
+                    signature = call_signature(call.name, call.arguments)
+                    if signature not in recent_signatures and signature not in speculative:
+                        speculative[signature] = asyncio.ensure_future(run_one(call))
+                
+                message = await stream_completion(response, start_early)
+            elif args.stream:
+                message = await stream_completion(response)
+            else:
+                message = response.choices[0].message
             response_text = message.content or ""
+            native_tool_calls = native_tool_calls or bool(getattr(message, "tool_calls", None))
             
             # Extract tool calls (handles both structured and text-embedded)
             tool_calls, reasoning_text = extract_tool_calls(message, response_text)
@@ -218,6 +513,24 @@ def main():
                 if len(tool_calls) < original_count:
                     print(f"\n⚠️  Filtered {original_count - len(tool_calls)} duplicate tool call(s)", file=sys.stderr)
             
+            # Reuse tasks that were started while streaming; only calls ahead
+            # of the turn's first write may have run early
+            first_write = next(
+                (i for i, tc in enumerate(tool_calls) if tc.name not in READ_ONLY_TOOLS),
+                len(tool_calls)
+            )
+            pending = [
+                speculative.pop(call_signature(tc.name, tc.arguments), None) if i < first_write else None
+                for i, tc in enumerate(tool_calls)
+            ]
+            
+            # Early-started calls missing from the final parse are read-only,
+            # so they are dropped rather than reported to the model
+            if speculative:
+                print(f"\n⚠️  Dropped {len(speculative)} early tool call(s) not in the final response", file=sys.stderr)
+                for task in speculative.values():
+                    task.cancel()
+            
             # If no tool calls, we're done
             if not tool_calls:
                 # Check if we're stuck asking for the same thing
@@ -229,43 +542,45 @@ def main():
                     print(response_text)
                 break
             
-            # Execute tool calls
-            print(f"\n[Step {step_count + 1}] Executing {len(tool_calls)} tool call(s)...", file=sys.stderr)
-            
             # Build assistant message with tool calls for conversation history
             assistant_msg = {
                 "role": "assistant",
                 "content": reasoning_text
             }
             
-            # Add tool_calls if using structured format
+            # Add tool_calls if using structured format; only the calls being
+            # executed are listed so every id gets a matching tool message
             if hasattr(message, 'tool_calls') and message.tool_calls:
-                assistant_msg["tool_calls"] = [
-                    {
-                        "id": tc.id,
-                        "type": "function",
-                        "function": {
-                            "name": tc.function.name,
-                            "arguments": tc.function.arguments
-                        }
-                    }
-                    for tc in message.tool_calls
-                ]
+                assistant_msg["tool_calls"] = [tc.as_tool_call() for tc in tool_calls]
             
             messages.append(assistant_msg)
             
-            for tool_call in tool_calls:
-                tool_name = tool_call["name"]
-                arguments = tool_call["arguments"]
-                tool_id = tool_call.get("id", f"call_{step_count}")
-                
-                print(f"  → {tool_name}({json.dumps(arguments, indent=2)})", file=sys.stderr)
-                
-                # Execute the tool
-                result = tool_executor.execute(tool_name, arguments)
+            # Runs of read-only calls overlap; every other call runs alone, in
+            # the order the model emitted it
+            outcomes = []
+            for _, group in itertools.groupby(
+                zip(tool_calls, pending), key=lambda item: item[0].name in READ_ONLY_TOOLS
+            ):
+                group = list(group)
+                fresh = [tc for tc, task in group if task is None]
+                batch, started = await asyncio.gather(
+                    run_batch(fresh),
+                    asyncio.gather(*(task for _, task in group if task is not None))
+                )
+                batch, started = iter(batch), iter(started)
+                outcomes.extend(next(batch) if task is None else next(started) for _, task in group)
+            
+            # Log the whole step with one write, in tool_calls order
+            header = f"\n[Step {step_count + 1}] Executed {len(tool_calls)} tool call(s)\n"
+            write_stderr(header.encode("utf-8") + b"".join(log for _, log in outcomes))
+            
+            # Append results in the original order so tool messages match tool_calls
+            for tool_call, (result, _) in zip(tool_calls, outcomes):
+                tool_name = tool_call.name
+                tool_id = tool_call.id or f"call_{step_count}"
                 
                 # Track this call to prevent duplicates
-                recent_tool_calls.append((tool_name, arguments))
+                recent_tool_calls.append((tool_name, tool_call.arguments))
                 
                 # Add tool result to messages (visible to model)
                 tool_result_msg = {
@@ -274,10 +589,6 @@ def main():
                     "content": f"TOOL RESULT ({tool_name}):\n{result}"
                 }
                 messages.append(tool_result_msg)
-                
-                # Print abbreviated result
-                result_preview = result[:200] + "..." if len(result) > 200 else result
-                print(f"     ✓ {result_preview}", file=sys.stderr)
             
             step_count += 1
             
@@ -298,4 +609,4 @@ def main():
 
 
 if __name__ == "__main__":
-    sys.exit(main())
+    sys.exit(asyncio.run(main()))
@@ -29,7 +29,8 @@ echo ""
 echo "2️⃣  Checking for model '$RALPH_MODEL'..."
 MODELS=$(curl -s "$OLLAMA_HOST/api/tags" | jq -r '.models[]?.name // empty' 2>/dev/null || echo "")
 
-if echo "$MODELS" | grep -q "^$RALPH_MODEL"; then
+# Match the exact name or a tag of it ("llama3.1" -> "llama3.1:latest"), not "llama3.1-foo"
+if echo "$MODELS" | awk -v m="$RALPH_MODEL" '$0 == m || index($0, m ":") == 1 { found = 1 } END { exit !found }'; then
     echo "   ✅ Model '$RALPH_MODEL' is available"
 else
     echo "   ❌ Model '$RALPH_MODEL' not found"
@@ -66,7 +67,7 @@ TEST_OUTPUT=$(python3 -c "
 from tool_parser import detect_tool_calls_in_text
 calls = detect_tool_calls_in_text('{\"name\": \"read_file\", \"arguments\": {\"path\": \"test.txt\"}}')
 assert len(calls) == 1
-assert calls[0]['name'] == 'read_file'
+assert calls[0].name == 'read_file'
 print('OK')
 " 2>&1)
 
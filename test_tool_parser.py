@@ -4,7 +4,10 @@ Tests for tool_parser.py
 """
 
 import json
-from tool_parser import detect_tool_calls_in_text, deduplicate_tool_calls, has_progress_markers
+from tool_parser import (
+    ParsedCall, detect_tool_calls_in_text, extract_tool_calls,
+    deduplicate_tool_calls, has_progress_markers, scan_streamed_tool_calls
+)
 
 
 def test_json_embedded():
@@ -16,8 +19,8 @@ def test_json_embedded():
     
     calls = detect_tool_calls_in_text(text)
     assert len(calls) == 1
-    assert calls[0]["name"] == "read_file"
-    assert calls[0]["arguments"]["path"] == "prd.json"
+    assert calls[0].name == "read_file"
+    assert calls[0].arguments["path"] == "prd.json"
     print("✓ JSON embedded test passed")
 
 
@@ -33,11 +36,57 @@ def test_multiple_calls():
     
     calls = detect_tool_calls_in_text(text)
     assert len(calls) == 2
-    assert calls[0]["name"] == "git_current_branch"
-    assert calls[1]["name"] == "read_file"
+    assert calls[0].name == "git_current_branch"
+    assert calls[1].name == "read_file"
     print("✓ Multiple calls test passed")
 
 
+def test_nested_arguments():
+    """Test detecting tool calls whose arguments contain nested objects."""
+    text = '''
+    Updating the config:
+    {"name": "write_file", "arguments": {"path": "a.json", "content": {"b": {"c": 1}}}}
+    '''
+    
+    calls = detect_tool_calls_in_text(text)
+    assert len(calls) == 1
+    assert calls[0].name == "write_file"
+    assert calls[0].arguments["content"] == {"b": {"c": 1}}
+    print("✓ Nested arguments test passed")
+
+
+def test_flat_and_nested_calls():
+    """Test a flat call does not hide a nested call in the same response."""
+    text = '''
+    {"name": "git_status", "arguments": {}}
+    {"name": "write_file", "arguments": {"path": "a.json", "content": {"b": {"c": 1}}}}
+    '''
+    
+    calls = detect_tool_calls_in_text(text)
+    assert [c.name for c in calls] == ["git_status", "write_file"]
+    print("✓ Flat and nested calls test passed")
+
+
+def test_streamed_scan():
+    """Test scanning a growing response resumes past text that can't become a call."""
+    text = 'Set {x} aside. {"name": "read_file", "arguments": {"path": "a'
+    
+    calls, pos = scan_streamed_tool_calls(text)
+    assert calls == []
+    assert text[pos:].startswith('{"name"')
+    
+    text += '.txt"}} and then {"name": "git_status", "argu'
+    calls, pos = scan_streamed_tool_calls(text, pos)
+    assert [c.name for c in calls] == ["read_file"]
+    assert text[pos:].startswith('{"name": "git_status"')
+    
+    text += 'ments": {}} done'
+    calls, pos = scan_streamed_tool_calls(text, pos)
+    assert [c.name for c in calls] == ["git_status"]
+    assert pos == len(text)
+    print("✓ Streamed scan test passed")
+
+
 def test_function_call_style():
     """Test detecting function-call style tool invocations."""
     text = '''
@@ -47,7 +96,7 @@ def test_function_call_style():
     
     calls = detect_tool_calls_in_text(text)
     assert len(calls) == 1
-    assert calls[0]["name"] == "read_file"
+    assert calls[0].name == "read_file"
     print("✓ Function call style test passed")
 
 
@@ -60,16 +109,33 @@ def test_multiline_format():
     
     calls = detect_tool_calls_in_text(text)
     assert len(calls) == 1
-    assert calls[0]["name"] == "read_file"
+    assert calls[0].name == "read_file"
     print("✓ Multi-line format test passed")
 
 
+def test_reasoning_text_cleanup():
+    """Test tool call text is stripped from the reasoning text."""
+    text = '''Let me look around.
+    {"name":"list_dir","arguments":{"path":"."}}
+    Tool: read_file
+    Arguments: {"path": "prd.json"}
+    Then I will decide.'''
+    
+    calls, reasoning = extract_tool_calls(None, text)
+    assert [c.name for c in calls] == ["list_dir", "read_file"]
+    assert [c.id for c in calls] == ["text_tool_0", "text_tool_1"]
+    assert "list_dir" not in reasoning and "Arguments" not in reasoning
+    assert reasoning.startswith("Let me look around.")
+    assert reasoning.endswith("Then I will decide.")
+    print("✓ Reasoning text cleanup test passed")
+
+
 def test_deduplication():
     """Test tool call deduplication."""
     new_calls = [
-        {"name": "read_file", "arguments": {"path": "prd.json"}},
-        {"name": "git_status", "arguments": {}},
-        {"name": "read_file", "arguments": {"path": "prd.json"}},  # duplicate
+        ParsedCall("read_file", {"path": "prd.json"}),
+        ParsedCall("git_status", {}),
+        ParsedCall("read_file", {"path": "prd.json"}),  # duplicate
     ]
     
     recent = [
@@ -78,10 +144,29 @@ def test_deduplication():
     
     unique = deduplicate_tool_calls(new_calls, recent)
     assert len(unique) == 1
-    assert unique[0]["name"] == "git_status"
+    assert unique[0].name == "git_status"
     print("✓ Deduplication test passed")
 
 
+def test_deduplication_key_order():
+    """Test deduplication ignores argument key order and repeats in one batch."""
+    new_calls = [
+        ParsedCall("grep", {"pattern": "TODO", "path": "src"}),
+        ParsedCall("grep", {"path": "src", "pattern": "TODO"}),
+        ParsedCall("list_dir", {"path": "."}),
+        ParsedCall("list_dir", {"path": "."}),
+    ]
+    
+    recent = [
+        ("grep", {"path": "src", "pattern": "TODO"}),
+    ]
+    
+    unique = deduplicate_tool_calls(new_calls, recent)
+    assert len(unique) == 1
+    assert unique[0].name == "list_dir"
+    print("✓ Deduplication key order test passed")
+
+
 def test_progress_detection():
     """Test progress marker detection."""
     messages = [
@@ -104,15 +189,36 @@ def test_no_progress():
     print("✓ No progress test passed")
 
 
+def test_progress_window():
+    """Test progress detection only looks at the requested window."""
+    messages = [
+        {"role": "tool", "content": "TOOL RESULT (write_file):\nSuccessfully wrote to prd.json"},
+        {"role": "assistant", "content": "File updated"},
+        {"role": "tool", "content": "TOOL RESULT (read_file):\n{...}"},
+        {"role": "assistant", "content": "I see the file"},
+    ]
+    
+    assert not has_progress_markers(messages, since_step=0)
+    assert not has_progress_markers(messages, since_step=-3)
+    assert has_progress_markers(messages, since_step=4)
+    print("✓ Progress window test passed")
+
+
 if __name__ == "__main__":
     print("Running tool_parser tests...\n")
     
     test_json_embedded()
     test_multiple_calls()
+    test_nested_arguments()
+    test_flat_and_nested_calls()
+    test_streamed_scan()
     test_function_call_style()
     test_multiline_format()
+    test_reasoning_text_cleanup()
     test_deduplication()
+    test_deduplication_key_order()
     test_progress_detection()
     test_no_progress()
+    test_progress_window()
     
     print("\n✅ All tests passed!")
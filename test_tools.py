@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Tests for tools.py
+"""
+
+import asyncio
+import json
+import os
+import stat
+import subprocess
+import tempfile
+from pathlib import Path
+
+from tools import ToolExecutor, _blocked_reason, _fast_rmtree
+
+
+def make_repo() -> Path:
+    """Create a temp git repo with one commit and return its path."""
+    root = Path(tempfile.mkdtemp(prefix="ralph_tools_"))
+    env = dict(os.environ, GIT_AUTHOR_NAME="t", GIT_AUTHOR_EMAIL="t@t",
+               GIT_COMMITTER_NAME="t", GIT_COMMITTER_EMAIL="t@t")
+    subprocess.run(["git", "init", "-q", "-b", "main"], cwd=root, check=True)
+    subprocess.run(["git", "config", "user.name", "t"], cwd=root, check=True)
+    subprocess.run(["git", "config", "user.email", "t@t"], cwd=root, check=True)
+    (root / "README.md").write_text("hello\n")
+    subprocess.run(["git", "add", "-A"], cwd=root, check=True)
+    subprocess.run(["git", "commit", "-q", "-m", "init"], cwd=root, check=True, env=env)
+    return root
+
+
+def test_write_after_command_removes_dir():
+    """Test write_file recreates a directory a test command deleted."""
+    executor = ToolExecutor(make_repo())
+    
+    assert executor.execute("write_file", {"path": "dist/a.txt", "content": "a"}).startswith("Success")
+    executor.execute("run_tests", {"command": "rm -rf dist"})
+    result = executor.execute("write_file", {"path": "dist/b.txt", "content": "b"})
+    assert result.startswith("Success"), result
+    print("✓ Write after command removes dir test passed")
+
+
+def test_write_after_external_removal():
+    """Test write_file retries when its known directory vanished behind its back."""
+    root = make_repo()
+    executor = ToolExecutor(root)
+    
+    executor.execute("write_file", {"path": "out/a.txt", "content": "a"})
+    subprocess.run(["rm", "-rf", str(root / "out")], check=True)
+    result = executor.execute("write_file", {"path": "out/b.txt", "content": "b"})
+    assert result.startswith("Success"), result
+    assert (root / "out" / "b.txt").read_text() == "b"
+    print("✓ Write after external removal test passed")
+
+
+def test_status_after_test_command():
+    """Test git_status isn't served from cache after a test command adds a file."""
+    executor = ToolExecutor(make_repo())
+    
+    assert executor.execute("git_status", {}).strip() in ("", "Working tree clean")
+    executor.execute("run_tests", {"command": "touch zz.txt"})
+    assert "zz.txt" in executor.execute("git_status", {})
+    print("✓ Status after test command test passed")
+
+
+def test_exists_cache_after_test_command():
+    """Test a cached miss for a docker input clears once a test command creates it."""
+    executor = ToolExecutor(make_repo())
+    
+    assert not executor._exists_cached("docker-compose.yml")
+    executor.execute("run_tests", {"command": "touch docker-compose.yml"})
+    assert executor._exists_cached("docker-compose.yml")
+    print("✓ Exists cache after test command test passed")
+
+
+def test_dev_null_redirect_allowed():
+    """Test redirects to /dev/null and friends aren't mistaken for device writes."""
+    for command in ("ls 2>/dev/null", "ls >/dev/null 2>&1", "echo x > /dev/stderr",
+                    "echo x >/dev/stdout", "echo x >/dev/fd/2"):
+        assert _blocked_reason(command) is None, command
+    # Quoting hides the path from the regex; the shlex pass must agree with it
+    assert _blocked_reason('ls 2> "/dev/null"') is None
+    for command in ("echo x > /dev/sda", "cat img >/dev/nvme0n1", "echo x >/dev/nullx",
+                    'echo x > "/dev/sda"', "cat img >> '/dev/sdb1'", 'x >| "/dev/sda"'):
+        assert _blocked_reason(command) is not None, command
+    print("✓ /dev/null redirect test passed")
+
+
+def test_status_collapses_untracked_dirs():
+    """Test git_status lists an untracked directory once, like `git status --short`."""
+    root = make_repo()
+    executor = ToolExecutor(root)
+    (root / "new" / "deep").mkdir(parents=True)
+    (root / "new" / "a.txt").write_text("a")
+    (root / "new" / "deep" / "b.txt").write_text("b")
+    (root / "README.md").write_text("changed\n")
+    
+    cli = subprocess.run(["git", "status", "--porcelain"], cwd=root, capture_output=True, text=True).stdout
+    assert executor.execute("git_status", {}) == cli
+    assert "?? new/\n" in cli
+    print("✓ Status collapses untracked dirs test passed")
+
+
+def test_commit_all():
+    """Test git_commit_all stages additions and deletions and commits them."""
+    root = make_repo()
+    executor = ToolExecutor(root)
+    (root / "a.txt").write_text("a")
+    (root / "README.md").unlink()
+    
+    assert executor.execute("git_commit_all", {"message": "second"}) == "Committed: second"
+    assert executor.execute("git_status", {}) == "Working tree clean"
+    files = subprocess.run(["git", "ls-files"], cwd=root, capture_output=True, text=True).stdout
+    assert files == "a.txt\n"
+    assert executor.execute("git_commit_all", {"message": "empty"}) == "No changes to commit"
+    print("✓ Commit all test passed")
+
+
+def test_commit_runs_hooks():
+    """Test git_commit_all still runs the repo's commit hooks."""
+    root = make_repo()
+    executor = ToolExecutor(root)
+    hook = root / ".git" / "hooks" / "pre-commit"
+    hook.write_text("#!/bin/sh\necho blocked >&2\nexit 1\n")
+    hook.chmod(0o755)
+    (root / "a.txt").write_text("a")
+    
+    result = executor.execute("git_commit_all", {"message": "hooked"})
+    assert result.startswith("Error committing"), result
+    log = subprocess.run(["git", "log", "--format=%s"], cwd=root, capture_output=True, text=True).stdout
+    assert log == "init\n"
+    print("✓ Commit runs hooks test passed")
+
+
+def test_grep_inprocess_and_bre_fallback():
+    """Test grep output format, binary notes, and grep's regex dialect."""
+    root = make_repo()
+    executor = ToolExecutor(root)
+    (root / "a.txt").write_text("foo bar\nfoo|bar\nbaz\n")
+    (root / "blob.bin").write_bytes(b"\0foo\n")
+    
+    result = executor.execute("grep", {"pattern": "^foo", "path": "."})
+    assert f"{root}/a.txt:1:foo bar\n" in result
+    assert f"{root}/a.txt:2:foo|bar\n" in result
+    assert "blob.bin" not in result
+    assert f"Binary file {root}/blob.bin matches\n" in executor.execute("grep", {"pattern": "foo", "path": "."})
+    assert executor.execute("grep", {"pattern": "baz", "path": "a.txt"}) == "3:baz\n"
+    # In grep's basic regexes `|` is literal and `\|` alternates
+    assert executor.execute("grep", {"pattern": "foo|bar", "path": "a.txt"}) == "2:foo|bar\n"
+    assert executor.execute("grep", {"pattern": "baz\\|foo bar", "path": "a.txt"}) == "1:foo bar\n3:baz\n"
+    assert executor.execute("grep", {"pattern": "qux", "path": "."}).startswith("No matches")
+    print("✓ Grep test passed")
+
+
+def test_read_file_window():
+    """Test read_file returns windows of large files with a continuation note."""
+    root = make_repo()
+    executor = ToolExecutor(root)
+    (root / "big.txt").write_text("0123456789" * 100)
+    
+    head = executor.execute("read_file", {"path": "big.txt", "length": 25})
+    assert head.startswith("0123456789012345678901234\n...[truncated 975 bytes; read again with offset=25")
+    assert executor.execute("read_file", {"path": "big.txt", "offset": 995}) == "56789"
+    assert executor.execute("read_file", {"path": "big.txt"}) == "0123456789" * 100
+    
+    # The whole-file cache must not outlive a write
+    executor.execute("write_file", {"path": "big.txt", "content": "new"})
+    assert executor.execute("read_file", {"path": "big.txt"}) == "new"
+    print("✓ Read file window test passed")
+
+
+def test_remove_tree():
+    """Test remove deletes a tree without following symlinks out of it."""
+    root = make_repo()
+    executor = ToolExecutor(root)
+    outside = Path(tempfile.mkdtemp(prefix="ralph_outside_"))
+    (outside / "keep.txt").write_text("keep")
+    (root / "tree" / "sub").mkdir(parents=True)
+    (root / "tree" / "sub" / "f.txt").write_text("f")
+    (root / "tree" / "link").symlink_to(outside)
+    
+    assert executor.execute("remove", {"path": "tree"}) == "Removed directory: tree"
+    assert not (root / "tree").exists()
+    assert (outside / "keep.txt").read_text() == "keep"
+    print("✓ Remove tree test passed")
+
+
+def test_remove_tree_stays_on_filesystem():
+    """Test the tree walk refuses to descend into a directory on another device."""
+    root = make_repo()
+    (root / "tree" / "sub").mkdir(parents=True)
+    (root / "tree" / "top.txt").write_text("t")
+    
+    # A root device that differs from every subdirectory's, as for a mount point
+    try:
+        _fast_rmtree(str(root / "tree"), os.stat(root / "tree").st_dev + 1)
+        assert False, "crossed a filesystem boundary"
+    except OSError as e:
+        assert "filesystem boundary" in str(e)
+    assert (root / "tree" / "sub").is_dir()
+    print("✓ Remove tree stays on filesystem test passed")
+
+
+def make_prd(root: Path) -> None:
+    """Write a prd.json whose file order differs from its priority order."""
+    (root / "prd.json").write_text(json.dumps({"userStories": [
+        {"id": "S1", "title": "one", "priority": 2, "passes": False},
+        {"id": "S2", "title": "two", "priority": 1, "passes": False},
+        {"id": "S3", "title": "three", "priority": 2, "passes": False},
+        {"id": "S4", "title": "four", "priority": 1, "passes": True},
+    ]}, indent=2))
+
+
+def next_story_id(executor: ToolExecutor) -> str:
+    """Return get_next_story's story id, or its all-complete marker."""
+    result = executor.execute("get_next_story", {})
+    return result if result == "ALL_STORIES_COMPLETE" else json.loads(result)["id"]
+
+
+def test_story_queue():
+    """Test get_next_story follows priority, then file order, as stories change."""
+    root = make_repo()
+    make_prd(root)
+    executor = ToolExecutor(root)
+    
+    assert next_story_id(executor) == "S2"
+    executor.execute("update_prd", {"story_id": "S2", "passes": True})
+    assert next_story_id(executor) == "S1"
+    executor.execute("update_prd", {"story_id": "S4", "passes": False})
+    assert next_story_id(executor) == "S4"
+    executor.execute("update_prd", {"story_id": "S4", "passes": True})
+    executor.execute("update_prd", {"story_id": "S1", "passes": True})
+    assert json.loads(executor.execute("get_next_story", {}))["remaining_stories"] == 0
+    assert next_story_id(executor) == "S3"
+    executor.execute("update_prd", {"story_id": "S3", "passes": True})
+    assert next_story_id(executor) == "ALL_STORIES_COMPLETE"
+    
+    # The queue is rebuilt when prd.json changes on disk
+    executor.execute("write_file", {"path": "prd.json", "content": json.dumps({"userStories": [
+        {"id": "N1", "priority": 1, "passes": False}]})})
+    assert next_story_id(executor) == "N1"
+    print("✓ Story queue test passed")
+
+
+def test_prd_save_keeps_mode():
+    """Test update_prd replaces prd.json atomically without changing its mode."""
+    root = make_repo()
+    make_prd(root)
+    (root / "prd.json").chmod(0o640)
+    executor = ToolExecutor(root)
+    
+    assert executor.execute("update_prd", {"story_id": "S1", "passes": True, "notes": "done"}) == "Updated S1: passes=True"
+    assert stat.S_IMODE(os.stat(root / "prd.json").st_mode) == 0o640
+    story = json.loads((root / "prd.json").read_text())["userStories"][0]
+    assert story["passes"] is True and story["notes"] == "done"
+    assert sorted(p.name for p in root.iterdir()) == [".git", "README.md", "prd.json"]
+    print("✓ PRD save keeps mode test passed")
+
+
+def test_update_prd_batch():
+    """Test consecutive update_prd calls in one turn share a single prd.json write."""
+    root = make_repo()
+    make_prd(root)
+    executor = ToolExecutor(root)
+    saves = []
+    save_prd = executor._save_prd
+    executor._save_prd = lambda prd: (saves.append(prd), save_prd(prd))
+    
+    results = asyncio.run(executor.execute_batch([
+        ("update_prd", {"story_id": "S1", "passes": True}),
+        ("update_prd", {"story_id": "S9", "passes": True}),
+        ("update_prd", {"story_id": "S2", "passes": True, "notes": "n"}),
+        ("read_file", {"path": "prd.json"}),
+    ]))
+    assert results[:3] == ["Updated S1: passes=True", "Error: Story S9 not found in prd.json",
+                           "Updated S2: passes=True"]
+    assert len(saves) == 1
+    # The write landed before the read that follows the batch
+    stories = json.loads(results[3])["userStories"]
+    assert [story["passes"] for story in stories] == [True, True, False, True]
+    assert stories == json.loads((root / "prd.json").read_text())["userStories"]
+    assert next_story_id(executor) == "S3"
+    print("✓ update_prd batch test passed")
+
+
+if __name__ == "__main__":
+    print("Running tools tests...\n")
+    
+    test_write_after_command_removes_dir()
+    test_write_after_external_removal()
+    test_status_after_test_command()
+    test_exists_cache_after_test_command()
+    test_dev_null_redirect_allowed()
+    test_status_collapses_untracked_dirs()
+    test_commit_all()
+    test_commit_runs_hooks()
+    test_grep_inprocess_and_bre_fallback()
+    test_read_file_window()
+    test_remove_tree()
+    test_remove_tree_stays_on_filesystem()
+    test_story_queue()
+    test_prd_save_keeps_mode()
+    test_update_prd_batch()
+    
+    print("\n✅ All tests passed!")
@@ -8,119 +8,194 @@ Handles both:
 
 import json
 import re
+from dataclasses import dataclass, field
 from typing import List, Dict, Any, Optional, Tuple
 
+from json_utils import dumps_sorted, json_loads
+from tools import TOOL_NAMES
 
-def detect_tool_calls_in_text(text: str) -> List[Dict[str, Any]]:
-    """
-    Parse tool calls from plain text responses.
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None  # pyahocorasick is optional
+
+
+# Pattern 2: "Tool: name" followed by "Arguments: {...}"
+_MULTILINE_RE = re.compile(r'Tool:\s*(\w+)\s+Arguments:\s*(\{[^}]*\})', re.IGNORECASE)
+
+# Pattern 3: function call style, e.g. read_file({"path": "prd.json"})
+_FUNC_CALL_RE = re.compile(r'(\w+)\(\s*(\{[^}]*\})\s*\)')
+
+# Incremental decoder for pulling JSON objects out of free text
+_DECODER = json.JSONDecoder()
+
+# Tool names accepted for function-call style invocations
+_COMMON_TOOLS = TOOL_NAMES
+
+
+# Tool result substrings that indicate real progress was made
+_PROGRESS_INDICATORS = (
+    "successfully wrote to",
+    "committed:",
+    "patch applied successfully",
+    "created directory:",
+    "✓", "✅", "success",
+    '"passes": true',
+    "test passed",
+    "all tests passed"
+)
+
+
+def _build_progress_matcher():
+    """Build a single-pass matcher for all progress indicators."""
+    if ahocorasick is not None:
+        automaton = ahocorasick.Automaton()
+        for indicator in _PROGRESS_INDICATORS:
+            automaton.add_word(indicator.lower(), indicator)
+        automaton.make_automaton()
+        return lambda lowered: next(automaton.iter(lowered), None) is not None
     
-    Looks for patterns like:
-    - {"name": "read_file", "arguments": {"path": "prd.json"}}
-    - {"name": "git_status", "arguments": {}}
-    - Tool: read_file
-      Arguments: {"path": "prd.json"}
+    pattern = re.compile("|".join(map(re.escape, _PROGRESS_INDICATORS)), re.IGNORECASE)
+    return lambda lowered: pattern.search(lowered) is not None
+
+
+_has_progress_indicator = _build_progress_matcher()
+
+
+@dataclass(slots=True)
+class ParsedCall:
+    """A tool call detected in a model response."""
+    name: str
+    arguments: Dict[str, Any] = field(default_factory=dict)
+    id: str = ""
     
-    Returns list of tool calls in format:
-    [
-        {"name": "read_file", "arguments": {"path": "prd.json"}},
-        ...
-    ]
+    def as_tool_call(self) -> Dict[str, Any]:
+        """Return the OpenAI message shape for this call."""
+        return {
+            "id": self.id,
+            "type": "function",
+            "function": {
+                "name": self.name,
+                "arguments": json.dumps(self.arguments)
+            }
+        }
+
+
+def scan_json_tool_calls(text: str, pos: int = 0) -> List[Tuple[ParsedCall, int, int]]:
     """
-    tool_calls = []
+    Find complete JSON tool-call objects in text, starting at ``pos``.
     
-    # Pattern 1: JSON objects with name and arguments
-    # Match complete JSON objects that have "name" and "arguments" keys
-    # More lenient pattern that handles nested braces
-    json_pattern = r'\{[^{}]*"name"[^{}]*"arguments"[^{}]*(?:\{[^{}]*\}[^{}]*)?\}'
+    Each '{' is handed to the JSON decoder, which consumes one value at a
+    time, so nested arguments are handled and incomplete trailing objects
+    (e.g. a response that is still streaming) are simply skipped.
     
-    for match in re.finditer(json_pattern, text, re.DOTALL):
+    Returns:
+        List of (tool_call, start, end) tuples with character offsets
+    """
+    return _scan_json(text, pos)[0]
+
+
+def scan_streamed_tool_calls(text: str, pos: int = 0) -> Tuple[List[ParsedCall], int]:
+    """
+    Like scan_json_tool_calls, for text that is still growing.
+    
+    Also returns where the next scan should start: the first '{' that may
+    yet complete into a call, or the end of the text, so each streamed
+    chunk is only decoded from there instead of from the last call found.
+    """
+    found, resume = _scan_json(text, pos)
+    return [call for call, _, _ in found], resume
+
+
+def _may_complete(text: str, error: json.JSONDecodeError) -> bool:
+    """Whether a failed decode could still succeed once more text arrives."""
+    # A partial string, number or literal fails at or just before the end of
+    # the text; anything earlier is already invalid JSON
+    return error.msg.startswith("Unterminated string") or error.pos >= len(text) - 8
+
+
+def _scan_json(text: str, pos: int) -> Tuple[List[Tuple[ParsedCall, int, int]], int]:
+    """Shared scanner for scan_json_tool_calls and scan_streamed_tool_calls."""
+    found = []
+    resume = None
+    idx = text.find('{', pos)
+    while idx != -1:
         try:
-            # Try to extract a valid JSON object
-            json_str = match.group()
-            obj = json.loads(json_str)
-            if "name" in obj and "arguments" in obj:
-                tool_calls.append({
-                    "name": obj["name"],
-                    "arguments": obj.get("arguments", {})
-                })
-        except json.JSONDecodeError:
-            # Try to find JSON by brace matching
+            obj, end = _DECODER.raw_decode(text, idx)
+        except json.JSONDecodeError as e:
+            if resume is None and _may_complete(text, e):
+                resume = idx
+            idx = text.find('{', idx + 1)
             continue
-    
-    # Pattern 1b: More aggressive JSON matching with nested braces
-    if not tool_calls:
-        # Find all potential JSON objects (balanced braces)
-        brace_depth = 0
-        start_idx = None
         
-        for i, char in enumerate(text):
-            if char == '{':
-                if brace_depth == 0:
-                    start_idx = i
-                brace_depth += 1
-            elif char == '}':
-                brace_depth -= 1
-                if brace_depth == 0 and start_idx is not None:
-                    json_str = text[start_idx:i+1]
-                    try:
-                        obj = json.loads(json_str)
-                        if "name" in obj and "arguments" in obj:
-                            tool_calls.append({
-                                "name": obj["name"],
-                                "arguments": obj.get("arguments", {})
-                            })
-                    except json.JSONDecodeError:
-                        pass
-                    start_idx = None
+        if isinstance(obj, dict) and "name" in obj and "arguments" in obj:
+            # "arguments": null means no arguments; any other non-object is
+            # not a call the executor can run, so it's skipped like bad JSON
+            arguments = {} if obj["arguments"] is None else obj["arguments"]
+            if isinstance(arguments, dict):
+                found.append((ParsedCall(obj["name"], arguments), idx, end))
+                resume = None
+            idx = text.find('{', end)
+        else:
+            idx = text.find('{', idx + 1)
+    
+    return found, len(text) if resume is None else resume
+
+
+def _scan_text_tool_calls(text: str) -> List[Tuple[ParsedCall, int, int]]:
+    """Find tool calls in text with all patterns, keeping their character spans."""
+    found = []
+    
+    # Pattern 1: JSON objects with name and arguments, decoded in place so
+    # nested argument objects are handled
+    found.extend(scan_json_tool_calls(text))
     
     # Pattern 2: Multi-line format
     # Tool: tool_name
     # Arguments: {json}
-    multiline_pattern = r'Tool:\s*(\w+)\s+Arguments:\s*(\{[^}]*\})'
-    
-    for match in re.finditer(multiline_pattern, text, re.IGNORECASE):
+    for match in _MULTILINE_RE.finditer(text):
         tool_name = match.group(1)
         try:
-            arguments = json.loads(match.group(2))
-            tool_calls.append({
-                "name": tool_name,
-                "arguments": arguments
-            })
+            arguments = json_loads(match.group(2))
+            found.append((ParsedCall(tool_name, arguments), match.start(), match.end()))
         except json.JSONDecodeError:
             continue
     
     # Pattern 3: Function call style
     # read_file({"path": "prd.json"})
-    func_call_pattern = r'(\w+)\(\s*(\{[^}]*\})\s*\)'
-    
-    for match in re.finditer(func_call_pattern, text):
+    for match in _FUNC_CALL_RE.finditer(text):
         tool_name = match.group(1)
         # Check if it's likely a tool name (common tool names)
-        common_tools = [
-            'read_file', 'write_file', 'list_dir', 'grep',
-            'git_status', 'git_diff', 'git_commit_all', 'git_current_branch',
-            'git_checkout', 'git_create_branch',
-            'run_cmd', 'mkdir', 'remove', 'apply_patch',
-            'run_tests', 'update_prd', 'append_progress', 'get_next_story',
-            'docker_build', 'docker_compose_up', 'docker_compose_down',
-            'docker_exec', 'docker_logs', 'docker_ps', 'docker_test'
-        ]
-        
-        if tool_name in common_tools:
+        if tool_name in _COMMON_TOOLS:
             try:
-                arguments = json.loads(match.group(2))
-                tool_calls.append({
-                    "name": tool_name,
-                    "arguments": arguments
-                })
+                arguments = json_loads(match.group(2))
+                found.append((ParsedCall(tool_name, arguments), match.start(), match.end()))
             except json.JSONDecodeError:
                 continue
     
-    return tool_calls
+    return found
 
 
-def extract_tool_calls(response_message, response_text: str) -> Tuple[List[Dict[str, Any]], str]:
+def detect_tool_calls_in_text(text: str) -> List[ParsedCall]:
+    """
+    Parse tool calls from plain text responses.
+    
+    Looks for patterns like:
+    - {"name": "read_file", "arguments": {"path": "prd.json"}}
+    - {"name": "git_status", "arguments": {}}
+    - Tool: read_file
+      Arguments: {"path": "prd.json"}
+    
+    Returns list of ParsedCall objects, e.g.:
+    [
+        ParsedCall(name="read_file", arguments={"path": "prd.json"}),
+        ...
+    ]
+    """
+    return [call for call, _, _ in _scan_text_tool_calls(text)]
+
+
+def extract_tool_calls(response_message, response_text: str) -> Tuple[List[ParsedCall], str]:
     """
     Extract tool calls from a response.
     
@@ -129,7 +204,7 @@ def extract_tool_calls(response_message, response_text: str) -> Tuple[List[Dict[
     
     Returns:
         (tool_calls, reasoning_text)
-        - tool_calls: List of {"name": ..., "arguments": ...} dicts
+        - tool_calls: List of ParsedCall objects, each with an id
         - reasoning_text: The text content minus tool call JSON
     """
     tool_calls = []
@@ -138,42 +213,52 @@ def extract_tool_calls(response_message, response_text: str) -> Tuple[List[Dict[
     # Check for structured tool calls first (OpenAI/Ollama format)
     if hasattr(response_message, 'tool_calls') and response_message.tool_calls:
         for tc in response_message.tool_calls:
-            tool_calls.append({
-                "name": tc.function.name,
-                "arguments": json.loads(tc.function.arguments) if isinstance(tc.function.arguments, str) else tc.function.arguments,
-                "id": tc.id
-            })
+            tool_calls.append(ParsedCall(
+                tc.function.name,
+                json_loads(tc.function.arguments) if isinstance(tc.function.arguments, str) else tc.function.arguments,
+                tc.id
+            ))
         return tool_calls, reasoning_text
     
     # Fall back to text parsing
     if response_text:
-        detected_calls = detect_tool_calls_in_text(response_text)
-        if detected_calls:
-            # Remove the JSON tool calls from reasoning text
-            cleaned_text = response_text
-            for call in detected_calls:
-                # Try to remove the JSON representation
-                json_str = json.dumps({"name": call["name"], "arguments": call["arguments"]})
-                cleaned_text = cleaned_text.replace(json_str, "")
-            
-            reasoning_text = cleaned_text.strip()
+        detected = _scan_text_tool_calls(response_text)
+        if detected:
+            # Remove the tool call text from the reasoning in a single pass
+            pieces = []
+            cursor = 0
+            for _, start, end in sorted(detected, key=lambda item: item[1]):
+                if start < cursor:
+                    continue  # Overlaps a span that was already removed
+                pieces.append(response_text[cursor:start])
+                cursor = end
+            pieces.append(response_text[cursor:])
+            reasoning_text = "".join(pieces).strip()
             
             # Add synthetic IDs for text-parsed calls
-            for i, call in enumerate(detected_calls):
-                if "id" not in call:
-                    call["id"] = f"text_tool_{i}"
-                tool_calls.extend([call])
+            for i, (call, _, _) in enumerate(detected):
+                if not call.id:
+                    call.id = f"text_tool_{i}"
+                tool_calls.append(call)
     
     return tool_calls, reasoning_text
 
 
+def call_signature(name: str, arguments: Any) -> Tuple[str, Any]:
+    """Build a hashable signature for a tool call, independent of key order."""
+    return name, dumps_sorted(arguments)
+
+
 def deduplicate_tool_calls(
-    tool_calls: List[Dict[str, Any]],
+    tool_calls: List[ParsedCall],
     recent_calls: List[Tuple[str, Dict[str, Any]]]
-) -> List[Dict[str, Any]]:
+) -> List[ParsedCall]:
     """
     Remove duplicate tool calls that were just executed.
     
+    Calls repeated within ``tool_calls`` itself are also collapsed to the
+    first occurrence.
+    
     Args:
         tool_calls: New tool calls to execute
         recent_calls: List of (tool_name, arguments) tuples from recent history
@@ -181,17 +266,13 @@ def deduplicate_tool_calls(
     Returns:
         Filtered list with duplicates removed
     """
+    seen = {call_signature(name, args) for name, args in recent_calls}
     unique_calls = []
     
     for call in tool_calls:
-        # Check if this exact call was just executed
-        is_duplicate = False
-        for recent_name, recent_args in recent_calls:
-            if call["name"] == recent_name and call["arguments"] == recent_args:
-                is_duplicate = True
-                break
-        
-        if not is_duplicate:
+        signature = call_signature(call.name, call.arguments)
+        if signature not in seen:
+            seen.add(signature)
             unique_calls.append(call)
     
     return unique_calls
@@ -209,30 +290,18 @@ def has_progress_markers(messages: List[Dict], since_step: int = -3) -> bool:
     
     Args:
         messages: Conversation history
-        since_step: How many steps back to check (negative = recent)
+        since_step: How many messages back to check (sign is ignored; 0 checks none)
     
     Returns:
         True if progress indicators found
     """
     # Look at recent tool results
-    recent_messages = messages[since_step:] if since_step < 0 else messages[-3:]
-    
-    progress_indicators = [
-        "successfully wrote to",
-        "committed:",
-        "patch applied successfully",
-        "created directory:",
-        "✓", "✅", "success",
-        '"passes": true',
-        "test passed",
-        "all tests passed"
-    ]
+    # messages[-0:] would be the whole history, so 0 has to be special-cased
+    recent_messages = messages[-abs(since_step):] if since_step else []
     
     for msg in recent_messages:
         if msg.get("role") == "tool":
-            content = msg.get("content", "").lower()
-            for indicator in progress_indicators:
-                if indicator.lower() in content:
-                    return True
+            if _has_progress_indicator(msg.get("content", "").lower()):
+                return True
     
     return False
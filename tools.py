@@ -2,11 +2,52 @@
 Tool definitions and executors for Ralph Ollama Runner.
 """
 
+import asyncio
+import bisect
+import contextlib
+import functools
+import hashlib
+import importlib
+import itertools
 import json
+import mmap
+import operator
 import os
+import re
+import selectors
+import shlex
+import shutil
+import signal
+import stat
 import subprocess
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+from urllib.parse import quote
+
+from json_utils import dump_pretty, json_loads
+
+try:
+    import pygit2
+except ImportError:
+    pygit2 = None  # pygit2 is optional; the git CLI is the fallback
+
+try:
+    import re2
+except ImportError:
+    re2 = None  # re2 is optional; stdlib re is the fallback
+
+# docker-py (docker CLI fallback), PyYAML (compose service hints) and
+# whatthepatch (git apply fallback) are optional too, but each serves only a
+# few tools, so they're loaded on first use via _lazy_import; docker-py alone
+# pulls in requests and urllib3.
+if TYPE_CHECKING:
+    import docker
 
 
 # Tool schemas compatible with OpenAI function calling format
@@ -22,6 +63,14 @@ TOOL_SCHEMAS = [
                     "path": {
                         "type": "string",
                         "description": "The file path to read (relative to workspace root)"
+                    },
+                    "offset": {
+                        "type": "integer",
+                        "description": "Byte offset to start reading at (default: 0)"
+                    },
+                    "length": {
+                        "type": "integer",
+                        "description": "Maximum number of bytes to return (default: 262144)"
                     }
                 },
                 "required": ["path"]
@@ -39,6 +88,10 @@ TOOL_SCHEMAS = [
                     "path": {
                         "type": "string",
                         "description": "The directory path to list (relative to workspace root, or '.' for current)"
+                    },
+                    "include_hidden": {
+                        "type": "boolean",
+                        "description": "Also include .git, node_modules, virtualenvs, caches and build output (default: false)"
                     }
                 },
                 "required": ["path"]
@@ -55,11 +108,15 @@ TOOL_SCHEMAS = [
                 "properties": {
                     "pattern": {
                         "type": "string",
-                        "description": "The search pattern (supports regex)"
+                        "description": "The search pattern (grep basic regex)"
                     },
                     "path": {
                         "type": "string",
                         "description": "The file or directory path to search in"
+                    },
+                    "include_hidden": {
+                        "type": "boolean",
+                        "description": "Also include .git, node_modules, virtualenvs, caches and build output (default: false)"
                     }
                 },
                 "required": ["pattern", "path"]
@@ -108,9 +165,13 @@ TOOL_SCHEMAS = [
                     "content": {
                         "type": "string",
                         "description": "The content to write to the file"
+                    },
+                    "source": {
+                        "type": "string",
+                        "description": "Copy this existing file instead of passing content (relative to workspace root)"
                     }
                 },
-                "required": ["path", "content"]
+                "required": ["path"]
             }
         }
     },
@@ -487,141 +548,1146 @@ TOOL_SCHEMAS = [
     }
 ]
 
+# O(1) lookups by tool name for parsers and argument validation
+TOOL_NAMES = frozenset(t["function"]["name"] for t in TOOL_SCHEMAS)
+_TOOL_BY_NAME = {t["function"]["name"]: t for t in TOOL_SCHEMAS}
+_TOOL_PARAMS = {
+    name: frozenset(schema["function"]["parameters"].get("properties", ()))
+    for name, schema in _TOOL_BY_NAME.items()
+}
+_TOOL_REQUIRED = {
+    name: tuple(schema["function"]["parameters"].get("required", ()))
+    for name, schema in _TOOL_BY_NAME.items()
+}
+
+
+# Shell syntax (pipes, redirects, globs, expansions) that needs a real /bin/sh
+_SHELL_SYNTAX_RE = re.compile(r"[|&;<>()$`*?\[\]{}~\n]")
+
+# A lone `&` (not &&, |&, >&, &>) backgrounds a job, which the persistent
+# shell can't frame; such commands get a fresh shell instead
+_BACKGROUND_RE = re.compile(r"(?<![&|>])&(?![&>])")
+
+# Obviously destructive commands that run_cmd refuses, matched in one scan;
+# redirecting to /dev/null, /dev/stdout, /dev/stderr or /dev/fd/N is fine
+_DANGEROUS_RE = re.compile(
+    r"rm\s+-rf\s+/|dd\s+if=|mkfs|>\s*/dev/(?!null\b|std(?:out|err)\b|fd/)",
+    re.IGNORECASE,
+)
+
+# Redirect targets under /dev that aren't devices, as whole shlex tokens
+_HARMLESS_DEV_RE = re.compile(r"/dev/(?:null|stdout|stderr|fd/\d+)")
+
+# shlex punctuation tokens that separate one simple command from the next
+_COMMAND_SEPARATORS = frozenset({";", "&", "&&", "|", "||", "(", ")", "\n"})
+
+# PATH lookups are repeated for every tool call; resolve each program once
+_which = functools.lru_cache(maxsize=None)(shutil.which)
+
+# Maximum number of files kept by ToolExecutor's read_file cache
+READ_CACHE_SIZE = 128
+
+# Heavy directories that grep doesn't descend into and list_dir omits by default
+_PRUNE = frozenset({
+    ".git", "node_modules", ".venv", "__pycache__", "dist", "build",
+    ".mypy_cache", ".pytest_cache",
+})
+
+# How the daemon (API), BuildKit and the classic builder say the Dockerfile is missing
+_MISSING_DOCKERFILE_RE = re.compile(
+    r"Cannot locate specified Dockerfile|failed to read dockerfile"
+    r"|unable to evaluate symlinks in Dockerfile path",
+    re.IGNORECASE,
+)
+
+# Build/compose output is only shown as a tail; cap what's kept while it streams
+DOCKER_LOG_LINES = 50
+DOCKER_OUTPUT_LIMIT = 16 * 1024
+
+# How long docker_ps output is reused when no tool could have changed the containers
+DOCKER_PS_TTL = 1.0
+
+# Tools that can start, stop or create containers; they drop the docker_ps cache
+_CONTAINER_MUTATING_TOOLS = frozenset({
+    "docker_compose_up", "docker_compose_down", "docker_exec", "docker_test", "run_cmd",
+})
+
+# Socket timeout for docker-py daemon requests (exec and logs block on this)
+DOCKER_API_TIMEOUT = 120
+
+# Files handed to each grep worker at a time
+GREP_BATCH_SIZE = 32
+
+# Batches queued on the grep pool ahead of the one being collected
+GREP_MAX_IN_FLIGHT = 64
+
+# grep stops scanning after this many matching lines
+GREP_MAX_MATCHES = 1000
+
+# The in-process grep gives up after this long, like the grep CLI's timeout
+GREP_TIMEOUT = 10.0
+
+# The in-process grep skips (and reports) files larger than this
+GREP_MAX_FILE_BYTES = 8 * 1024 * 1024
+
+# Characters whose meaning differs between grep's basic regexes and Python's
+# (alternation, grouping, repetition, escapes, POSIX classes); patterns with
+# any of them go to the grep CLI so the tool keeps grep's dialect
+_BRE_SENSITIVE_RE = re.compile(r"[|+?(){}\\]|\[[:=.]")
+
+# How long git_status/git_diff output is reused while HEAD and the index are unchanged
+GIT_CACHE_TTL = 0.5
+
+# How long the docker tools trust a cached existence check for their input files
+EXISTS_CACHE_TTL = 2.0
+
+# Tools with no side effects; calls to them may overlap one another, while
+# every other tool runs alone, in the order the model emitted it
+READ_ONLY_TOOLS = frozenset({
+    "read_file", "list_dir", "grep", "git_status", "git_diff", "git_current_branch",
+    "get_next_story", "docker_ps", "docker_logs",
+})
+
+# Tools that run arbitrary commands, which can do anything to the workspace
+# (docker_exec and docker_test run in containers that may mount it)
+_COMMAND_TOOLS = frozenset({"run_cmd", "run_tests", "docker_exec", "docker_test"})
+
+# Tools that can change the workspace (and so what git status/diff report);
+# they drop the git cache and the docker tools' existence cache
+_GIT_MUTATING_TOOLS = _COMMAND_TOOLS | {
+    "write_file", "apply_patch", "mkdir", "remove",
+    "git_checkout", "git_create_branch", "git_commit_all",
+}
+
+# Tools that can delete directories; they drop write_file's known-directory set
+_DIR_REMOVING_TOOLS = _COMMAND_TOOLS | {
+    "apply_patch", "remove", "git_checkout", "git_create_branch",
+}
+
+# Tools that can rewrite prd.json behind the parsed-PRD cache's back; they drop it
+_PRD_WRITING_TOOLS = _COMMAND_TOOLS | {
+    "write_file", "apply_patch", "remove", "git_checkout", "git_create_branch",
+}
+
+# Bytes read_file returns per call unless the caller asks for a different length
+READ_MAX_BYTES = 256 * 1024
+
+# read_file windows of files above this size are sliced from an mmap
+MMAP_READ_THRESHOLD = 1 << 20
+
+# Bytes of stdout/stderr kept per stream from a subprocess (head + tail)
+OUTPUT_LIMIT = 256 * 1024
+
+
+
+def _command_argv(command: str) -> List[str]:
+    """
+    Turn a shell command string into an argv list.
+    
+    Simple commands are split with shlex and exec'd directly, skipping the
+    intermediate /bin/sh. Anything using shell syntax, builtins, or env
+    assignments still runs through `sh -c`.
+    """
+    if not _SHELL_SYNTAX_RE.search(command):
+        try:
+            argv = shlex.split(command)
+        except ValueError:
+            argv = []
+        if argv and "=" not in argv[0] and _which(argv[0]):
+            return argv
+    return ["/bin/sh", "-c", command]
+
+
+def _dangerous_argv(argv: List[str]) -> Optional[str]:
+    """Return why one simple command is refused, or None if it's allowed."""
+    while argv and ("=" in argv[0] or argv[0] in ("sudo", "command", "exec", "nohup")):
+        argv = argv[1:]
+    if not argv:
+        return None
+    
+    name = os.path.basename(argv[0])
+    if name.startswith("mkfs"):
+        return name
+    if name == "dd" and any(arg.startswith("of=/dev/") for arg in argv[1:]):
+        return "dd of=/dev/"
+    if name == "rm":
+        flags = [arg for arg in argv[1:] if arg.startswith("-")]
+        recursive = any(
+            arg in ("--recursive", "-r", "-R") or (not arg.startswith("--") and ("r" in arg or "R" in arg))
+            for arg in flags
+        )
+        targets = [arg for arg in argv[1:] if not arg.startswith("-")]
+        if recursive and any(os.path.normpath(t.rstrip("*")) in ("/", "//") for t in targets if t.startswith("/")):
+            return "rm -r /"
+    return None
+
+
+def _blocked_reason(command: str) -> Optional[str]:
+    """
+    Check a run_cmd command against the denylist.
+    
+    The regex catches the common spellings in one scan; the command is then
+    tokenized with shlex so quoting and flag order (`rm -r -f "/"`) don't
+    slip past it, checking each simple command in a pipeline or list.
+    """
+    match = _DANGEROUS_RE.search(command)
+    if match:
+        return match.group(0)
+    
+    lexer = shlex.shlex(command, posix=True, punctuation_chars=True)
+    lexer.whitespace_split = True
+    try:
+        tokens = list(lexer)
+    except ValueError:
+        return None  # Unbalanced quotes; the shell will reject it too
+    
+    argv: List[str] = []
+    previous = ""
+    for token in itertools.chain(tokens, [";"]):
+        # A quoted device path after a redirect slips past the regex
+        if previous.rstrip("|").endswith(">") and token.startswith("/dev/") and not _HARMLESS_DEV_RE.fullmatch(token):
+            return f"> {token}"
+        previous = token
+        if token in _COMMAND_SEPARATORS:
+            reason = _dangerous_argv(argv)
+            if reason:
+                return reason
+            argv = []
+        else:
+            argv.append(token)
+    return None
+
+
+def _fast_rmtree(root: str, root_dev: int) -> None:
+    """
+    Delete a directory tree, stat-free for everything but subdirectories.
+    
+    Entry types come from scandir's d_type; files and symlinks are unlinked
+    as they're seen and directories removed deepest-first afterwards.
+    Refuses to descend into a directory on another filesystem (st_dev).
+    """
+    stack = [root]
+    dirs = []
+    while stack:
+        current = stack.pop()
+        dirs.append(current)
+        with os.scandir(current) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.stat(follow_symlinks=False).st_dev != root_dev:
+                        raise OSError(f"Refusing to cross a filesystem boundary at {entry.path}")
+                    stack.append(entry.path)
+                else:
+                    os.unlink(entry.path)
+    for directory in reversed(dirs):
+        os.rmdir(directory)
+
+
+@functools.lru_cache(maxsize=1)
+def _minute_stamp(minute: int) -> str:
+    """Local 'YYYY-MM-DD HH:MM' for a minute since the epoch, formatted once per minute."""
+    return datetime.fromtimestamp(minute * 60).strftime("%Y-%m-%d %H:%M")
+
+
+@functools.lru_cache(maxsize=1024)
+def _abs_path(root: str, path: str) -> str:
+    """Memoized workspace path join; tools see the same handful of paths repeatedly."""
+    return os.path.normpath(os.path.join(root, path))
+
+
+def _read_window(path: str, size: int, offset: int, length: int) -> bytes:
+    """
+    Read length bytes at offset without touching the rest of the file.
+    
+    Big files are sliced out of an mmap so only the pages in the window are
+    faulted in; smaller ones take a single pread.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if size > MMAP_READ_THRESHOLD:
+            with mmap.mmap(fd, 0, prot=mmap.PROT_READ) as mm:
+                return mm[offset:offset + length]
+        return os.pread(fd, length, offset)
+    finally:
+        os.close(fd)
+
+
+def _content_digest(data: bytes) -> bytes:
+    """Short content hash write_file remembers to spot no-op rewrites."""
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def _write_atomic(file_path: str, data: bytes, mode: Optional[int] = None,
+                  durable: bool = False) -> None:
+    """
+    Write data to a temp file beside file_path, then rename it into place.
+    
+    Readers (and a crash mid-write) see either the old file or the new
+    one, never a truncated mix. mode, if given, replaces the umask default;
+    durable fsyncs the data before the rename so a power loss can't leave
+    an empty file behind either.
+    """
+    tmp_path = f"{file_path}.{uuid.uuid4().hex[:8]}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        if mode is not None:
+            os.fchmod(fd, mode)
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+        if durable:
+            os.fsync(fd)
+    except BaseException:
+        os.close(fd)
+        os.unlink(tmp_path)
+        raise
+    os.close(fd)
+    os.replace(tmp_path, file_path)
+
+
+def _is_binary(data: bytes) -> bool:
+    """Sniff for a NUL byte in the first 8KB, the same heuristic grep uses."""
+    return b"\0" in data[:8192]
+
+
+def _grep_files(regex: Any, paths: List[str], with_names: bool, deadline: float) -> List[str]:
+    """
+    grep -n style output lines for every line in paths matching regex.
+    
+    Binary files get grep's one-line "Binary file ... matches" note, and
+    files over GREP_MAX_FILE_BYTES a skip note. Stops at the deadline.
+    """
+    lines = []
+    for file_path in paths:
+        if time.monotonic() > deadline:
+            break
+        try:
+            with open(file_path, "rb") as f:
+                if os.fstat(f.fileno()).st_size > GREP_MAX_FILE_BYTES:
+                    lines.append(f"{file_path}: skipped, larger than {GREP_MAX_FILE_BYTES >> 20} MB\n")
+                    continue
+                data = f.read()
+        except OSError:
+            continue
+        # Whole-buffer search rejects most files before splitting lines
+        if not regex.search(data):
+            continue
+        if _is_binary(data):
+            lines.append(f"Binary file {file_path} matches\n")
+            continue
+        
+        prefix = f"{file_path}:" if with_names else ""
+        for lineno, line in enumerate(data.splitlines(), 1):
+            if regex.search(line):
+                lines.append(f"{prefix}{lineno}:{line.decode('utf-8', errors='replace')}\n")
+    return lines
+
+
+def _cap_matches(lines: List[str]) -> str:
+    """Join grep output lines, truncated to GREP_MAX_MATCHES with a note."""
+    if len(lines) <= GREP_MAX_MATCHES:
+        return "".join(lines)
+    return "".join(lines[:GREP_MAX_MATCHES]) + f"... (stopped after {GREP_MAX_MATCHES} matches)\n"
+
+
+@functools.lru_cache(maxsize=None)
+def _grep_pool() -> ThreadPoolExecutor:
+    """Shared reader pool for the in-process grep, created on first use."""
+    return ThreadPoolExecutor(
+        max_workers=min(32, (os.cpu_count() or 1) * 4),
+        thread_name_prefix="ralph-grep",
+    )
+
+
+_entry_name = operator.attrgetter("name")
+
+
+def _walk_files(root: str, include_hidden: bool = False) -> Iterator[str]:
+    """Yield regular files under root, skipping _PRUNE dirs and not following symlinked dirs."""
+    stack = [root]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if include_hidden or entry.name not in _PRUNE:
+                            stack.append(entry.path)
+                    elif entry.is_file():
+                        yield entry.path
+                except OSError:
+                    continue
+
+
+def _grep_tree(regex: Any, search_path: str, include_hidden: bool, deadline: float) -> List[str]:
+    """Output lines of the in-process grep over every file under search_path."""
+    # Batches of files are read and scanned on a pool so read() syscalls
+    # (which release the GIL, as does re2's matching) overlap. Batches are
+    # submitted lazily so the walk stops once GREP_MAX_MATCHES is reached.
+    files = iter(_walk_files(search_path, include_hidden))
+    batches = iter(lambda: list(itertools.islice(files, GREP_BATCH_SIZE)), [])
+    pool = _grep_pool()
+    in_flight = deque()
+    lines = []
+    
+    def collect_oldest():
+        lines.extend(in_flight.popleft().result())
+    
+    for batch in batches:
+        if time.monotonic() > deadline:
+            break
+        in_flight.append(pool.submit(_grep_files, regex, batch, True, deadline))
+        if len(in_flight) >= GREP_MAX_IN_FLIGHT:
+            collect_oldest()
+            if len(lines) >= GREP_MAX_MATCHES:
+                break
+    while in_flight and len(lines) < GREP_MAX_MATCHES:
+        collect_oldest()
+    for future in in_flight:
+        future.cancel()
+    return lines
+
+
+def _open_repository(path: str) -> Optional["pygit2.Repository"]:
+    """Open the git repository containing path with pygit2, or None."""
+    if pygit2 is None:
+        return None
+    try:
+        repo_path = pygit2.discover_repository(path)
+        return pygit2.Repository(repo_path) if repo_path else None
+    except pygit2.GitError:
+        return None
+
+
+@functools.lru_cache(maxsize=None)
+def _lazy_import(name: str) -> Any:
+    """Import an optional, tool-specific module on first use; None if it isn't installed."""
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+
+def _open_docker_client() -> Optional["docker.DockerClient"]:
+    """Create a docker-py client from the environment (DOCKER_HOST etc.), or None."""
+    docker = _lazy_import("docker")
+    if docker is None:
+        return None
+    try:
+        return docker.from_env(timeout=DOCKER_API_TIMEOUT)
+    except docker.errors.DockerException:
+        return None
+
+
+def _docker_socket_path() -> Optional[str]:
+    """The daemon's UNIX socket from DOCKER_HOST (or the default), if it exists."""
+    host = os.environ.get("DOCKER_HOST")
+    if host and not host.startswith("unix://"):
+        return None  # tcp:// and ssh:// daemons are left to the CLI
+    path = host[len("unix://"):] if host else "/var/run/docker.sock"
+    return path if os.path.exists(path) else None
+
+
+def _open_daemon_http() -> Any:
+    """A keep-alive httpx client on the docker socket, or None if there's no socket."""
+    httpx = _lazy_import("httpx")
+    path = _docker_socket_path()
+    if httpx is None or path is None:
+        return None
+    return httpx.Client(
+        transport=httpx.HTTPTransport(uds=path),
+        base_url="http://docker",
+        timeout=DOCKER_API_TIMEOUT,
+    )
+
+
+def _demux_docker_stream(data: bytes) -> bytes:
+    """
+    Join the payloads of a multiplexed attach/logs stream.
+    
+    Each frame is an 8-byte header (stream id, 3 zero bytes, big-endian
+    length) and its payload. Containers with a TTY send raw bytes instead,
+    which is what comes back when the data doesn't parse as frames.
+    """
+    parts = []
+    offset = 0
+    while offset < len(data):
+        header = data[offset:offset + 8]
+        if len(header) < 8 or header[0] > 2 or header[1:4] != b"\0\0\0":
+            return data
+        size = int.from_bytes(header[4:8], "big")
+        parts.append(data[offset + 8:offset + 8 + size])
+        offset += 8 + size
+    return b"".join(parts)
+
+
+def _format_ports(ports: List[Dict[str, Any]]) -> str:
+    """Render /containers/json port entries the way `docker ps` does."""
+    rendered = []
+    for port in ports or ():
+        target = f"{port.get('PrivatePort')}/{port.get('Type', 'tcp')}"
+        if port.get("PublicPort"):
+            target = f"{port.get('IP', '0.0.0.0')}:{port['PublicPort']}->{target}"
+        rendered.append(target)
+    return ", ".join(rendered)
+
+
+def _api_docker_exec(client: "docker.DockerClient", container: str, command: str) -> subprocess.CompletedProcess:
+    """Run `sh -c command` in a container over the daemon socket."""
+    # The low-level API takes the container name directly, saving the
+    # inspect round trip containers.get() would make on every call
+    exec_id = client.api.exec_create(container, ["sh", "-c", command])["Id"]
+    stdout, stderr = client.api.exec_start(exec_id, demux=True)
+    exit_code = client.api.exec_inspect(exec_id)["ExitCode"]
+    return subprocess.CompletedProcess(
+        command, exit_code, _decode_output(stdout or b""), _decode_output(stderr or b"")
+    )
+
+
+def _api_docker_logs(client: "docker.DockerClient", container: str, tail: int) -> str:
+    """
+    Fetch a container's combined stdout/stderr logs in one daemon request.
+    
+    APIClient.logs() inspects the container first to learn whether it has a
+    TTY; the raw request skips that, and _demux_docker_stream tells framed
+    output from a TTY's raw bytes by itself.
+    """
+    api = client.api
+    response = api._get(
+        api._url("/containers/{0}/logs", container),
+        params={"stdout": 1, "stderr": 1, "tail": tail},
+    )
+    api._raise_for_status(response)  # NotFound and friends, as logs() raises them
+    output = _decode_output(_demux_docker_stream(response.content))
+    return output if output else "(no logs)"
+
+
+def _api_docker_ps(client: "docker.DockerClient", all: bool) -> str:
+    """List containers as the NAMES/STATUS/PORTS table `docker ps --format` prints."""
+    # sparse=True keeps this to the single /containers/json request
+    containers = client.containers.list(all=all, sparse=True)
+    return _format_containers(
+        (
+            ",".join(n.lstrip("/") for n in c.attrs.get("Names", ())),
+            c.attrs.get("Status", ""),
+            _format_ports(c.attrs.get("Ports")),
+        )
+        for c in containers
+    )
+
+
+def _format_containers(rows: Iterator[Tuple[str, str, str]]) -> str:
+    """The NAMES/STATUS/PORTS table docker_ps returns, from (name, status, ports) rows."""
+    lines = ["NAMES\tSTATUS\tPORTS"]
+    lines.extend("\t".join(row) for row in rows)
+    if len(lines) == 1:
+        return "No containers running"
+    return "\n".join(lines) + "\n"
+
+
+def _api_docker_build(client: "docker.DockerClient", tag: str, context: str, dockerfile: str) -> str:
+    """Build an image through the daemon API, keeping only the tail of its log."""
+    # The low-level stream is consumed as it arrives; images.build() would
+    # hold the whole log in memory first
+    log: "deque[str]" = deque(maxlen=DOCKER_LOG_LINES)
+    for chunk in client.api.build(path=context, dockerfile=dockerfile, tag=tag,
+                                  rm=True, decode=True, timeout=600):
+        if "error" in chunk:
+            return f"Docker build failed:\n{chunk['error']}\n{''.join(log)}"
+        if "stream" in chunk:
+            log.append(chunk["stream"])
+    output = "".join(log)
+    return f"Successfully built image: {tag}\n{output[-500:]}"
+
+
+class _OutputBuffer:
+    """
+    Keeps the first and last OUTPUT_LIMIT // 2 bytes of a stream.
+    
+    Anything in between is only counted, so a command that prints hundreds
+    of MB costs bounded memory and the model still sees both ends.
+    """
+    
+    __slots__ = ("head", "tail", "total", "half")
+    
+    def __init__(self, limit: Optional[int] = None) -> None:
+        self.half = (limit or OUTPUT_LIMIT) // 2
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+    
+    def write(self, chunk: bytes) -> None:
+        self.total += len(chunk)
+        room = self.half - len(self.head)
+        if room > 0:
+            self.head += chunk[:room]
+            chunk = chunk[room:]
+        if chunk:
+            self.tail += chunk
+            if len(self.tail) > self.half:
+                del self.tail[:len(self.tail) - self.half]
+    
+    def getvalue(self) -> bytes:
+        dropped = self.total - len(self.head) - len(self.tail)
+        if dropped <= 0:
+            return bytes(self.head + self.tail)
+        return b"".join((self.head, f"\n... [{dropped} bytes truncated] ...\n".encode(), self.tail))
+
+
+def _decode_output(data: bytes) -> str:
+    """Decode captured output the way text=True would (UTF-8, universal newlines)."""
+    text = data.decode("utf-8", errors="replace")
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+def _spawn(args: List[str], cwd: Optional[Path], input: Optional[str] = None,
+           timeout: Optional[float] = None,
+           limit: Optional[int] = None) -> subprocess.CompletedProcess:
+    """
+    Run a program and capture its text output.
+    
+    The executable is resolved to an absolute path and close_fds is left off
+    so CPython can spawn with vfork/posix_spawn instead of a full fork of the
+    runner process. Descriptors Python opens are non-inheritable by default,
+    so nothing extra leaks into the child.
+    
+    cwd=None runs the child in the runner's own directory, skipping the
+    chdir between fork and exec; use it when every path argument is absolute.
+    
+    stdout and stderr are read incrementally into bounded head+tail buffers
+    of limit bytes each (see _OutputBuffer). Raises subprocess.TimeoutExpired like subprocess.run.
+    """
+    executable = _which(args[0])
+    if executable:
+        args = [executable, *args[1:]]
+    proc = subprocess.Popen(
+        args,
+        cwd=os.fspath(cwd) if cwd is not None else None,
+        stdin=subprocess.PIPE if input is not None else None,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        close_fds=False,
+    )
+    
+    buffers = {proc.stdout: _OutputBuffer(limit), proc.stderr: _OutputBuffer(limit)}
+    deadline = None if timeout is None else time.monotonic() + timeout
+    
+    def remaining() -> Optional[float]:
+        if deadline is None:
+            return None
+        left = deadline - time.monotonic()
+        if left <= 0:
+            proc.kill()
+            proc.wait()
+            raise subprocess.TimeoutExpired(args, timeout)
+        return left
+    
+    try:
+        with selectors.DefaultSelector() as selector:
+            for stream in buffers:
+                selector.register(stream, selectors.EVENT_READ)
+            if input is not None:
+                pending_input = memoryview(input.encode("utf-8"))
+                os.set_blocking(proc.stdin.fileno(), False)
+                if pending_input:
+                    selector.register(proc.stdin, selectors.EVENT_WRITE)
+                else:
+                    proc.stdin.close()
+            
+            while selector.get_map():
+                for key, _ in selector.select(remaining()):
+                    stream = key.fileobj
+                    if stream is proc.stdin:
+                        try:
+                            pending_input = pending_input[os.write(key.fd, pending_input[:65536]):]
+                        except BrokenPipeError:
+                            pending_input = pending_input[:0]
+                        if not pending_input:
+                            selector.unregister(stream)
+                            stream.close()
+                        continue
+                    
+                    chunk = os.read(key.fd, 65536)
+                    if chunk:
+                        buffers[stream].write(chunk)
+                    else:
+                        selector.unregister(stream)
+        
+        try:
+            returncode = proc.wait(timeout=remaining())
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+            raise subprocess.TimeoutExpired(args, timeout)
+    finally:
+        for stream in (proc.stdin, proc.stdout, proc.stderr):
+            if stream is not None and not stream.closed:
+                stream.close()
+    
+    return subprocess.CompletedProcess(
+        args,
+        returncode,
+        _decode_output(buffers[proc.stdout].getvalue()),
+        _decode_output(buffers[proc.stderr].getvalue()),
+    )
+
+
+class _PersistentShell:
+    """
+    A long-lived bash process that runs commands without a fresh shell startup.
+    
+    Each command runs in a subshell (a fork of the warm bash, no exec) so cd,
+    exports, and `exit` can't leak into later commands. Output is framed by a
+    per-call sentinel printed on both stdout and stderr. Backgrounded jobs
+    (`cmd &`) are not supported: they would keep writing after the sentinel,
+    into the next command's output, so callers send them elsewhere.
+    """
+    
+    def __init__(self, cwd: Path) -> None:
+        self.cwd = cwd
+        self.lock = threading.Lock()
+        self._proc = None
+    
+    def _start(self) -> None:
+        self._proc = subprocess.Popen(
+            [_which("bash")],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=os.fspath(self.cwd),
+            close_fds=False,
+            start_new_session=True,  # So a timeout can kill the whole group
+        )
+    
+    def kill(self) -> None:
+        if self._proc is not None:
+            try:
+                os.killpg(self._proc.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+            self._proc.wait()
+            self._proc = None
+    
+    def run(self, command: str, cwd: Path, timeout: float) -> subprocess.CompletedProcess:
+        """Run command in cwd; raises subprocess.TimeoutExpired like subprocess.run."""
+        if self._proc is None or self._proc.poll() is not None:
+            self._start()
+        proc = self._proc
+        
+        sentinel = f"__RALPH_DONE_{uuid.uuid4().hex}__".encode()
+        script = (
+            f"( cd -- {shlex.quote(os.fspath(cwd))} && eval {shlex.quote(command)} ) </dev/null; "
+            f"__ralph_rc=$?; printf '\\n%s:%s\\n' {sentinel.decode()} $__ralph_rc; "
+            f"printf '\\n%s\\n' {sentinel.decode()} >&2\n"
+        )
+        try:
+            proc.stdin.write(script.encode())
+            proc.stdin.flush()
+        except BrokenPipeError:
+            self.kill()
+            raise
+        
+        buffers = {proc.stdout: _OutputBuffer(), proc.stderr: _OutputBuffer()}
+        # stdout is only done once the whole `<sentinel>:<rc>` line is in
+        markers = {
+            proc.stdout: re.compile(b"\n" + re.escape(sentinel) + rb":(\d+)\n"),
+            proc.stderr: re.compile(b"\n" + re.escape(sentinel) + b"\n"),
+        }
+        # Recent bytes per stream, so a sentinel split across reads is still found
+        carry = {proc.stdout: b"", proc.stderr: b""}
+        returncode = 1
+        pending = set(buffers)
+        deadline = time.monotonic() + timeout
+        with selectors.DefaultSelector() as selector:
+            for stream in buffers:
+                selector.register(stream, selectors.EVENT_READ)
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.kill()
+                    raise subprocess.TimeoutExpired(command, timeout)
+                for key, _ in selector.select(remaining):
+                    stream = key.fileobj
+                    chunk = os.read(stream.fileno(), 65536)
+                    if not chunk:
+                        # The shell died (e.g. killed externally); start fresh next time
+                        self.kill()
+                        raise RuntimeError("persistent shell exited unexpectedly")
+                    buffers[stream].write(chunk)
+                    window = carry[stream] + chunk
+                    carry[stream] = window[-len(sentinel) - 16:]
+                    match = markers[stream].search(window)
+                    if stream in pending and match:
+                        if stream is proc.stdout:
+                            returncode = int(match.group(1))
+                        pending.discard(stream)
+                        selector.unregister(stream)
+        
+        stdout = buffers[proc.stdout].getvalue().partition(b"\n" + sentinel + b":")[0]
+        stderr = buffers[proc.stderr].getvalue().partition(b"\n" + sentinel + b"\n")[0]
+        return subprocess.CompletedProcess(
+            command,
+            returncode,
+            _decode_output(stdout),
+            _decode_output(stderr),
+        )
+
 
 class ToolExecutor:
     """Executes tool calls and returns results."""
     
-    def __init__(self, workspace_root: Path):
+    # Tool name -> unbound method, filled in below the class body
+    _DISPATCH: Dict[str, Callable[..., str]] = {}
+    
+    def __init__(self, workspace_root: Path, persistent_shell: bool = False,
+                 max_concurrency: int = 8) -> None:
         self.workspace_root = workspace_root
+        # Hot paths join with os.path on this instead of building Path objects
+        self._root_str = os.fspath(workspace_root)
+        self._prd_path = os.path.join(self._root_str, "prd.json")
+        self._progress_path = os.path.join(self._root_str, "progress.txt")
+        
+        # Opt-in warm bash for run_cmd commands that need shell syntax
+        self._shell = _PersistentShell(workspace_root) if persistent_shell and _which("bash") else None
+        
+        # LRU of resolved path -> (size, mtime_ns, content) for read_file
+        self._read_cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._read_lock = threading.Lock()  # Tools run on a thread pool
+        
+        # In-process libgit2 handle, opened on first git tool call (see _repo)
+        self._repo_handle = None
+        self._repo_checked = False
+        self._repo_open_lock = threading.Lock()
+        self._git_lock = threading.Lock()
+        
+        # (operation, args) -> (state key, timestamp, output) for status/diff
+        self._git_cache: Dict[tuple, tuple] = {}
+        
+        # all flag -> (timestamp, output) of the last docker_ps
+        self._ps_cache: Dict[bool, Tuple[float, str]] = {}
+        
+        # compose path -> (mtime_ns, size, service names) for container hints
+        self._compose_cache: Dict[str, Tuple[int, int, List[str]]] = {}
+        self._active_compose: Optional[str] = None
+        
+        # path -> (timestamp, exists) for docker build/compose inputs
+        self._exists_cache: Dict[str, Tuple[float, bool]] = {}
+        
+        # (mtime_ns, size, branch) parsed from .git/HEAD by git_current_branch
+        self._head_cache: Optional[Tuple[int, int, str]] = None
+        
+        # Directories write_file has already created or seen
+        self._known_dirs: Set[str] = set()
+        
+        # path -> (size, mtime_ns, digest) of files write_file last wrote
+        self._file_hashes: Dict[str, Tuple[int, int, bytes]] = {}
+        
+        # (mtime_ns, size, parsed dict, story id -> (position, story),
+        # incomplete-story queue or None) of prd.json for get_next_story/update_prd
+        self._prd_cache: Optional[Tuple[int, int, Dict[str, Any], Dict[Any, tuple], Optional[list]]] = None
+        # Reentrant so a coalesced run of update_prd calls can hold it throughout
+        self._prd_lock = threading.RLock()
+        # Open batch_updates() scopes, and the PRD whose write they deferred
+        self._prd_batch_depth = 0
+        self._dirty_prd: Optional[Dict[str, Any]] = None
+        # (the _prd_cache entry it was computed from, get_next_story result)
+        self._next_story_memo: Optional[Tuple[tuple, str]] = None
+        
+        # docker-py client, connected on first docker tool call (see _docker)
+        self._docker_client = None
+        self._docker_checked = False
+        # Without docker-py, docker_logs talks HTTP to the daemon socket (see _daemon_http)
+        self._daemon_client = None
+        self._daemon_checked = False
+        
+        # execute_async runs tool bodies on this pool, at most max_concurrency at once
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="ralph-tool")
+        self._slots = asyncio.Semaphore(max_concurrency)
     
     def execute(self, tool_name: str, arguments: Dict[str, Any]) -> str:
         """Execute a tool and return the result as a string."""
+        handler = self._DISPATCH.get(tool_name)
+        if handler is None:
+            return f"Error: Unknown tool '{tool_name}'"
         try:
-            if tool_name == "read_file":
-                return self._read_file(arguments["path"])
-            elif tool_name == "list_dir":
-                return self._list_dir(arguments["path"])
-            elif tool_name == "grep":
-                return self._grep(arguments["pattern"], arguments["path"])
-            elif tool_name == "git_status":
-                return self._git_status()
-            elif tool_name == "git_diff":
-                return self._git_diff(arguments.get("cached", False))
-            elif tool_name == "write_file":
-                return self._write_file(arguments["path"], arguments["content"])
-            elif tool_name == "apply_patch":
-                return self._apply_patch(arguments["patch"])
-            elif tool_name == "run_cmd":
-                return self._run_cmd(arguments["command"], arguments.get("cwd", "."))
-            elif tool_name == "mkdir":
-                return self._mkdir(arguments["path"])
-            elif tool_name == "remove":
-                return self._remove(arguments["path"])
-            elif tool_name == "git_checkout":
-                return self._git_checkout(arguments["branch"])
-            elif tool_name == "git_create_branch":
-                return self._git_create_branch(arguments["branch"], arguments.get("from_ref", "main"))
-            elif tool_name == "git_commit_all":
-                return self._git_commit_all(arguments["message"])
-            elif tool_name == "git_current_branch":
-                return self._git_current_branch()
-            elif tool_name == "run_tests":
-                return self._run_tests(arguments["command"])
-            elif tool_name == "update_prd":
-                return self._update_prd(
-                    arguments["story_id"],
-                    arguments["passes"],
-                    arguments.get("notes", "")
-                )
-            elif tool_name == "append_progress":
-                return self._append_progress(
-                    arguments["story_id"],
-                    arguments["summary"],
-                    arguments.get("files_changed", []),
-                    arguments.get("learnings", "")
-                )
-            elif tool_name == "get_next_story":
-                return self._get_next_story()
-            elif tool_name == "docker_build":
-                return self._docker_build(
-                    arguments["tag"],
-                    arguments["context"],
-                    arguments.get("dockerfile", "Dockerfile")
-                )
-            elif tool_name == "docker_compose_up":
-                return self._docker_compose_up(
-                    arguments["compose_file"],
-                    arguments.get("detach", True),
-                    arguments.get("build", False)
-                )
-            elif tool_name == "docker_compose_down":
-                return self._docker_compose_down(
-                    arguments["compose_file"],
-                    arguments.get("volumes", False)
-                )
-            elif tool_name == "docker_exec":
-                return self._docker_exec(
-                    arguments["container"],
-                    arguments["command"]
-                )
-            elif tool_name == "docker_logs":
-                return self._docker_logs(
-                    arguments["container"],
-                    arguments.get("tail", 100)
-                )
-            elif tool_name == "docker_ps":
-                return self._docker_ps(arguments.get("all", False))
-            elif tool_name == "docker_test":
-                return self._docker_test(
-                    arguments["test_command"],
-                    arguments.get("container")
-                )
-            else:
-                return f"Error: Unknown tool '{tool_name}'"
+            if not isinstance(arguments, dict):
+                return f"Error: Arguments for {tool_name} must be a JSON object, got {type(arguments).__name__}"
+            missing = [name for name in _TOOL_REQUIRED[tool_name] if name not in arguments]
+            if missing:
+                return f"Error: Missing required argument(s) for {tool_name}: {', '.join(missing)}"
+            
+            # Method parameters mirror the schema properties; unknown keys the
+            # model invents are dropped, and method defaults fill optional ones
+            allowed = _TOOL_PARAMS[tool_name]
+            kwargs = {k: v for k, v in arguments.items() if k in allowed}
+            
+            # A write update_prd deferred lands before prd.json can be rewritten
+            if tool_name in _PRD_WRITING_TOOLS and self._dirty_prd is not None:
+                with self._prd_lock:
+                    self._flush_prd()
+            return handler(self, **kwargs)
         except Exception as e:
             return f"Error executing {tool_name}: {str(e)}"
+        finally:
+            if tool_name in _GIT_MUTATING_TOOLS:
+                self._git_cache.clear()
+                self._exists_cache.clear()
+            if tool_name in _DIR_REMOVING_TOOLS:
+                self._known_dirs.clear()
+            if tool_name in _PRD_WRITING_TOOLS:
+                with self._prd_lock:
+                    self._prd_cache = None
+            if tool_name in _CONTAINER_MUTATING_TOOLS:
+                self._ps_cache.clear()
+    
+    async def execute_async(self, tool_name: str, arguments: Dict[str, Any]) -> str:
+        """
+        Execute a tool without blocking the event loop.
+        
+        Tool bodies (file IO, libgit2, subprocesses) run on the executor's
+        thread pool, so calls gathered from one assistant turn overlap.
+        """
+        return await self._run_pooled(functools.partial(self.execute, tool_name, arguments))
+    
+    async def execute_batch(self, calls: List[Tuple[str, Dict[str, Any]]]) -> List[str]:
+        """
+        Execute one assistant turn's tool calls; results are in call order.
+        
+        Consecutive read-only calls (READ_ONLY_TOOLS) run concurrently; any
+        other call runs alone once everything before it has finished, so
+        writes land in the order the model emitted them.
+        
+        Without libgit2, a git_status and git_current_branch in the same
+        read-only run share a single `git status --porcelain --branch` run,
+        and consecutive update_prd calls share one prd.json write (see
+        _run_prd_updates).
+        """
+        async def run_reads(segment: List[Tuple[str, Dict[str, Any]]]) -> List[str]:
+            fused = None
+            if {"git_status", "git_current_branch"} <= {name for name, _ in segment} and self._repo is None:
+                fused = asyncio.ensure_future(self._run_pooled(self._git_status_and_branch))
+            
+            async def run(name: str, arguments: Dict[str, Any]) -> str:
+                if fused is not None and name in ("git_status", "git_current_branch"):
+                    status, branch = await fused
+                    return status if name == "git_status" else branch
+                return await self.execute_async(name, arguments)
+            
+            return await asyncio.gather(*(run(name, arguments) for name, arguments in segment))
+        
+        results = []
+        for read_only, segment in itertools.groupby(calls, key=lambda call: call[0] in READ_ONLY_TOOLS):
+            if read_only:
+                results.extend(await run_reads(list(segment)))
+                continue
+            for name, group in itertools.groupby(segment, key=operator.itemgetter(0)):
+                group = list(group)
+                if name == "update_prd" and len(group) > 1:
+                    updates = functools.partial(self._run_prd_updates, [arguments for _, arguments in group])
+                    results.extend(await self._run_pooled(updates))
+                else:
+                    for _, arguments in group:
+                        results.append(await self.execute_async(name, arguments))
+        return results
+    
+    def _run_prd_updates(self, updates: List[Dict[str, Any]]) -> List[str]:
+        """
+        Run several update_prd calls with one prd.json write.
+        
+        _prd_lock is held from the first update through the write, so no
+        other tool sees or rewrites prd.json in between.
+        """
+        with self._prd_lock:
+            self._begin_prd_batch()
+            try:
+                results = [self.execute("update_prd", arguments) for arguments in updates]
+            finally:
+                error = self._end_prd_batch()
+        if error:
+            results = [result if result.startswith("Error") else error for result in results]
+        return results
+    
+    @contextlib.contextmanager
+    def batch_updates(self) -> Iterator[None]:
+        """
+        Defer update_prd's writes until the outermost batch exits.
+        
+        Updates inside the batch only change the cached PRD, which
+        get_next_story reads too; one serialize and write covers them all.
+        """
+        self._begin_prd_batch()
+        try:
+            yield
+        finally:
+            error = self._end_prd_batch()
+            if error:
+                raise OSError(error)
+    
+    def _begin_prd_batch(self) -> None:
+        """Open a batch_updates() scope."""
+        with self._prd_lock:
+            self._prd_batch_depth += 1
+    
+    def _end_prd_batch(self) -> Optional[str]:
+        """Close a batch_updates() scope, writing deferred updates if it was the last."""
+        with self._prd_lock:
+            self._prd_batch_depth -= 1
+            if self._prd_batch_depth:
+                return None
+            try:
+                self._flush_prd()
+            except OSError as e:
+                return f"Error: Could not write prd.json: {e}"
+            return None
+    
+    def _flush_prd(self) -> None:
+        """Write the PRD if update_prd deferred a write. Call with _prd_lock held."""
+        prd = self._dirty_prd
+        if prd is not None:
+            self._save_prd(prd)
+            self._dirty_prd = None
+    
+    async def _run_pooled(self, func: Callable[[], Any]) -> Any:
+        """Run func on the tool pool under the same concurrency bound as execute_async."""
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._pool, func)
     
-    def _read_file(self, path: str) -> str:
-        """Read a file's contents."""
-        file_path = self.workspace_root / path
-        if not file_path.exists():
+    def _abs(self, path: str) -> str:
+        """Absolute, normalized string path for a workspace-relative path."""
+        return _abs_path(self._root_str, path)
+    
+    def _exists_cached(self, path: str) -> bool:
+        """
+        os.path.exists for a workspace path, reused for EXISTS_CACHE_TTL seconds.
+        
+        Misses are cached too; every tool that can create files, including
+        the command-running ones, clears the cache in execute().
+        """
+        full_path = self._abs(path)
+        now = time.monotonic()
+        cached = self._exists_cache.get(full_path)
+        if cached is not None and now - cached[0] < EXISTS_CACHE_TTL:
+            return cached[1]
+        exists = os.path.exists(full_path)
+        self._exists_cache[full_path] = (now, exists)
+        return exists
+    
+    def _resolve(self, path: str) -> Tuple[str, Optional[os.stat_result]]:
+        """
+        Join path onto the workspace root and stat it once.
+        
+        Returns (full_path, stat_result); stat_result is None if the path
+        doesn't exist. Callers test the mode with stat.S_ISREG/S_ISDIR
+        instead of separate exists()/is_file()/is_dir() syscalls.
+        """
+        full_path = self._abs(path)
+        try:
+            return full_path, os.stat(full_path)
+        except OSError:
+            return full_path, None
+    
+    def _read_file(self, path: str, offset: int = 0, length: int = READ_MAX_BYTES) -> str:
+        """Read a file's contents, at most length bytes starting at offset."""
+        file_path, st = self._resolve(path)
+        if st is None:
             return f"Error: File not found: {path}"
-        if not file_path.is_file():
+        if not stat.S_ISREG(st.st_mode):
             return f"Error: Not a file: {path}"
         try:
-            return file_path.read_text()
+            offset, length = max(0, int(offset)), max(1, int(length))
+        except (TypeError, ValueError):
+            return "Error: offset and length must be integers"
+        if offset or st.st_size > length:
+            return self._read_file_window(path, file_path, st.st_size, offset, length)
+        
+        key = file_path
+        with self._read_lock:
+            cached = self._read_cache.get(key)
+            if cached is not None and cached[:2] == (st.st_size, st.st_mtime_ns):
+                self._read_cache.move_to_end(key)
+                return cached[2]
+        
+        try:
+            with open(file_path) as f:
+                content = f.read()
         except UnicodeDecodeError:
             return f"Error: Cannot read binary file: {path}"
+        
+        with self._read_lock:
+            self._read_cache[key] = (st.st_size, st.st_mtime_ns, content)
+            self._read_cache.move_to_end(key)
+            if len(self._read_cache) > READ_CACHE_SIZE:
+                self._read_cache.popitem(last=False)
+        return content
+    
+    def _forget_reads(self, file_path: Optional[str] = None) -> None:
+        """Drop read_file's cached contents for one file, or for every file."""
+        with self._read_lock:
+            if file_path is None:
+                self._read_cache.clear()
+            else:
+                self._read_cache.pop(file_path, None)
+    
+    def _read_file_window(self, path: str, file_path: str, size: int,
+                          offset: int, length: int) -> str:
+        """Read one window of a file too large (or too far in) for a whole read."""
+        data = _read_window(file_path, size, offset, length)
+        if _is_binary(data):
+            return f"Error: Cannot read binary file: {path}"
+        
+        # The window edges can split a multi-byte character
+        content = data.decode("utf-8", errors="replace")
+        if "\r" in content:
+            content = content.replace("\r\n", "\n").replace("\r", "\n")
+        end = offset + len(data)
+        if end < size:
+            content += f"\n...[truncated {size - end} bytes; read again with offset={end} for more]"
+        return content
     
-    def _list_dir(self, path: str) -> str:
+    def _list_dir(self, path: str, include_hidden: bool = False) -> str:
         """List directory contents."""
-        dir_path = self.workspace_root / path
-        if not dir_path.exists():
+        dir_path = self._abs(path)
+        
+        # scandir reports the entry type from getdents (d_type), so listing
+        # costs no per-entry stat, and its errors replace an up-front check
+        try:
+            with os.scandir(dir_path) as it:
+                entries = sorted(it, key=_entry_name)
+        except FileNotFoundError:
             return f"Error: Directory not found: {path}"
-        if not dir_path.is_dir():
+        except NotADirectoryError:
             return f"Error: Not a directory: {path}"
         
-        items = []
-        for item in sorted(dir_path.iterdir()):
-            if item.is_dir():
-                items.append(f"{item.name}/")
-            else:
-                items.append(item.name)
+        items = [
+            e.name + "/" if e.is_dir(follow_symlinks=False) else e.name
+            for e in entries
+            if include_hidden or e.name not in _PRUNE or not e.is_dir(follow_symlinks=False)
+        ]
         
         return "\n".join(items) if items else "(empty directory)"
     
-    def _grep(self, pattern: str, path: str) -> str:
+    def _grep(self, pattern: str, path: str, include_hidden: bool = False) -> str:
         """Search for pattern in files."""
-        search_path = self.workspace_root / path
-        if not search_path.exists():
+        search_path, st = self._resolve(path)
+        if st is None:
             return f"Error: Path not found: {path}"
         
+        output = self._grep_inprocess(pattern, search_path, stat.S_ISREG(st.st_mode), include_hidden)
+        if output is not None:
+            return output if output else f"No matches found for pattern: {pattern}"
+        
         try:
-            result = subprocess.run(
-                ["grep", "-r", "-n", pattern, str(search_path)],
-                cwd=self.workspace_root,
-                capture_output=True,
-                text=True,
+            result = _spawn(
+                ["grep", "-r", "-n",
+                 *([] if include_hidden else [f"--exclude-dir={name}" for name in sorted(_PRUNE)]),
+                 pattern, search_path],
+                self.workspace_root,
                 timeout=10
             )
             
@@ -634,13 +1700,292 @@ class ToolExecutor:
         except subprocess.TimeoutExpired:
             return "Error: Search timed out"
     
+    def _grep_inprocess(self, pattern: str, search_path: str, is_file: bool,
+                        include_hidden: bool = False) -> Optional[str]:
+        """
+        Scan files for pattern without spawning grep.
+        
+        Produces grep -r -n style output (no filename prefix when searching a
+        single file). Returns None for patterns whose meaning would differ
+        from grep's basic regexes, or that don't compile, so the caller can
+        fall back to the grep CLI and its error reporting.
+        """
+        if _BRE_SENSITIVE_RE.search(pattern):
+            return None
+        engine = re2 if re2 is not None else re
+        try:
+            regex = engine.compile(pattern.encode(), engine.MULTILINE)
+        except Exception:
+            return None
+        
+        deadline = time.monotonic() + GREP_TIMEOUT
+        if is_file:
+            lines = _grep_files(regex, [search_path], False, deadline)
+        else:
+            lines = _grep_tree(regex, search_path, include_hidden, deadline)
+        
+        output = _cap_matches(lines)
+        if time.monotonic() > deadline:
+            output += f"... (search timed out after {GREP_TIMEOUT:g} seconds)\n"
+        return output
+    
+    @property
+    def _repo(self) -> Optional["pygit2.Repository"]:
+        """The libgit2 repository, opened once on first use; None means use the git CLI."""
+        if not self._repo_checked:
+            with self._repo_open_lock:
+                if not self._repo_checked:
+                    self._repo_handle = _open_repository(self._root_str)
+                    self._repo_checked = True
+        return self._repo_handle
+    
+    @property
+    def _docker(self) -> Optional["docker.DockerClient"]:
+        """The docker-py client, created once on first use; None means use the docker CLI."""
+        if not self._docker_checked:
+            with self._repo_open_lock:
+                if not self._docker_checked:
+                    self._docker_client = _open_docker_client()
+                    self._docker_checked = True
+        return self._docker_client
+    
+    @property
+    def _daemon_http(self) -> Any:
+        """httpx client on the docker socket, created once on first use; None if unavailable."""
+        if not self._daemon_checked:
+            with self._repo_open_lock:
+                if not self._daemon_checked:
+                    self._daemon_client = _open_daemon_http()
+                    self._daemon_checked = True
+        return self._daemon_client
+    
+    def _daemon_logs(self, container: str, tail: int) -> Optional[str]:
+        """
+        Fetch container logs straight from the daemon's HTTP API.
+        
+        Returns None when the socket can't be used so the caller can run
+        the docker CLI; the connection is kept alive between calls.
+        """
+        client = self._daemon_http
+        if client is None:
+            return None
+        httpx = _lazy_import("httpx")
+        try:
+            response = client.get(
+                f"/containers/{quote(container, safe='')}/logs",
+                params={"stdout": 1, "stderr": 1, "tail": tail},
+            )
+        except httpx.HTTPError:
+            return None
+        
+        if response.status_code == 404:
+            return f"Error: No such container: {container}"
+        if response.status_code != 200:
+            return None
+        output = _decode_output(_demux_docker_stream(response.content))
+        return output if output else "(no logs)"
+    
+    def _docker_api(self, func: Callable[..., Any], *args: Any) -> Any:
+        """
+        Call a docker-py helper with the shared daemon client.
+        
+        Returns None when docker-py or the daemon connection isn't available,
+        in which case the caller uses the docker CLI. Daemon errors come back
+        as "Error: ..." strings instead of falling back, since an exec'd
+        command must not run twice.
+        """
+        client = self._docker
+        if client is None:
+            return None
+        docker = _lazy_import("docker")
+        try:
+            return func(client, *args)
+        except docker.errors.NotFound as e:
+            return f"Error: {e.explanation or e}"
+        except docker.errors.DockerException as e:
+            return f"Error: {e}"
+        except OSError as e:  # requests' connection/timeout errors subclass IOError
+            return f"Error: Docker request failed: {e}"
+    
+    def _inprocess_git(self, func: Callable[..., str], *args: Any) -> Optional[str]:
+        """
+        Run a pygit2-backed git helper under the repository lock.
+        
+        Returns None when pygit2 is unavailable or the operation fails, in
+        which case the caller falls back to the git CLI.
+        """
+        if self._repo is None:
+            return None
+        try:
+            with self._git_lock:
+                return func(*args)
+        except (pygit2.GitError, KeyError, ValueError, OSError):
+            return None
+    
+    def _libgit2_status(self) -> str:
+        """Format repository status like `git status --porcelain`."""
+        index_codes = (
+            (pygit2.GIT_STATUS_INDEX_NEW, "A"),
+            (pygit2.GIT_STATUS_INDEX_MODIFIED, "M"),
+            (pygit2.GIT_STATUS_INDEX_DELETED, "D"),
+            (pygit2.GIT_STATUS_INDEX_RENAMED, "R"),
+            (pygit2.GIT_STATUS_INDEX_TYPECHANGE, "T"),
+        )
+        worktree_codes = (
+            (pygit2.GIT_STATUS_WT_MODIFIED, "M"),
+            (pygit2.GIT_STATUS_WT_DELETED, "D"),
+            (pygit2.GIT_STATUS_WT_RENAMED, "R"),
+            (pygit2.GIT_STATUS_WT_TYPECHANGE, "T"),
+        )
+        
+        # "normal" lists an untracked directory once as `dir/`, as the CLI does
+        try:
+            entries = self._repo.status(untracked_files="normal")
+        except TypeError:
+            raise ValueError("pygit2 too old to collapse untracked directories")  # Use the CLI
+        
+        lines = []
+        for path, flags in sorted(entries.items()):
+            if flags & pygit2.GIT_STATUS_IGNORED:
+                continue
+            if flags & pygit2.GIT_STATUS_CONFLICTED:
+                code = "UU"
+            elif flags & pygit2.GIT_STATUS_WT_NEW and not flags & ~pygit2.GIT_STATUS_WT_NEW:
+                code = "??"
+            else:
+                x = next((c for flag, c in index_codes if flags & flag), " ")
+                y = next((c for flag, c in worktree_codes if flags & flag), " ")
+                code = x + y
+            lines.append(f"{code} {path}")
+        
+        if not lines:
+            return "Working tree clean"
+        return "\n".join(lines) + "\n"
+    
+    def _libgit2_diff(self, cached: bool) -> str:
+        """Diff the index against HEAD (cached) or the working tree against the index."""
+        if cached:
+            diff = self._repo.diff("HEAD", cached=True)
+        else:
+            diff = self._repo.diff()
+        
+        patch = diff.patch
+        if not patch or not patch.strip():
+            return "No changes" if not cached else "No staged changes"
+        return patch
+    
+    def _libgit2_checkout(self, branch: str) -> str:
+        """Check out an existing local branch."""
+        ref = self._repo.lookup_branch(branch)
+        if ref is None:
+            raise KeyError(branch)  # Let the git CLI resolve remotes, tags, and SHAs
+        self._repo.checkout(ref, strategy=pygit2.GIT_CHECKOUT_SAFE)
+        return f"Checked out branch: {branch}"
+    
+    def _libgit2_create_branch(self, branch: str, from_ref: str) -> str:
+        """Create a local branch at from_ref and check it out."""
+        try:
+            commit = self._repo.revparse_single(from_ref).peel(pygit2.Commit)
+        except (KeyError, pygit2.GitError) as e:
+            return f"Error checking out {from_ref}: {e}"
+        
+        try:
+            new_branch = self._repo.branches.local.create(branch, commit)
+        except pygit2.AlreadyExistsError as e:
+            return f"Error creating branch: {e}"
+        
+        try:
+            self._repo.checkout(new_branch, strategy=pygit2.GIT_CHECKOUT_SAFE)
+        except pygit2.GitError as e:
+            new_branch.delete()
+            return f"Error creating branch: {e}"
+        return f"Created and checked out new branch: {branch} (from {from_ref})"
+    
+    def _libgit2_commit_all(self, message: str) -> str:
+        """Stage all changes (including deletions) and commit them."""
+        repo = self._repo
+        if self._has_commit_hooks():
+            raise ValueError("commit hooks need the git CLI")  # libgit2 doesn't run hooks
+        
+        index = repo.index
+        index.read()
+        index.add_all()  # Like `git add -A`: also stages deletions
+        tree = index.write_tree()
+        
+        if repo.head_is_unborn:
+            parents = []
+        else:
+            head_commit = repo.head.peel(pygit2.Commit)
+            if head_commit.tree_id == tree:
+                return "No changes to commit"
+            parents = [head_commit.id]
+        
+        signature = repo.default_signature
+        repo.create_commit("HEAD", signature, signature, message, tree, parents)
+        # Only now, so a failed commit leaves the index for the CLI fallback untouched
+        index.write()
+        return f"Committed: {message}"
+    
+    def _has_commit_hooks(self) -> bool:
+        """Whether git commit would run a hook (honouring core.hooksPath)."""
+        repo = self._repo
+        hooks_dir = os.path.join(repo.path, "hooks")
+        if "core.hooksPath" in repo.config:
+            hooks_dir = os.path.join(self._root_str, os.path.expanduser(repo.config["core.hooksPath"]))
+        for name in ("pre-commit", "prepare-commit-msg", "commit-msg", "post-commit"):
+            hook = os.path.join(hooks_dir, name)
+            if os.path.isfile(hook) and os.access(hook, os.X_OK):
+                return True
+        return False
+    
+    def _libgit2_current_branch(self) -> str:
+        """Get the current branch name ("HEAD" when detached)."""
+        if self._repo.head_is_detached:
+            return "HEAD"
+        return self._repo.head.shorthand
+    
+    def _git_state_key(self) -> Optional[Tuple[bytes, int]]:
+        """HEAD contents plus index mtime, or None if they can't be read."""
+        git_dir = self._repo.path if self._repo is not None else os.path.join(self._root_str, ".git")
+        try:
+            with open(os.path.join(git_dir, "HEAD"), "rb") as f:
+                head = f.read()
+            return head, os.stat(os.path.join(git_dir, "index")).st_mtime_ns
+        except OSError:
+            return None
+    
+    def _cached_git(self, op: tuple, compute: Callable[[], str]) -> str:
+        """
+        Reuse a recent status/diff result when HEAD and the index are unchanged.
+        
+        Worktree edits don't touch the index, so entries also expire after
+        GIT_CACHE_TTL; edits made through our own tools clear the cache in
+        execute().
+        """
+        key = self._git_state_key()
+        now = time.monotonic()
+        cached = self._git_cache.get(op)
+        if key is not None and cached is not None and cached[0] == key and now - cached[1] < GIT_CACHE_TTL:
+            return cached[2]
+        
+        output = compute()
+        if key is not None and not output.startswith("Error"):
+            self._git_cache[op] = (key, now, output)
+        return output
+    
     def _git_status(self) -> str:
         """Get git status."""
-        result = subprocess.run(
+        return self._cached_git(("status",), self._compute_git_status)
+    
+    def _compute_git_status(self) -> str:
+        """Run git status without the cache."""
+        output = self._inprocess_git(self._libgit2_status)
+        if output is not None:
+            return output
+        
+        result = _spawn(
             ["git", "status", "--porcelain"],
-            cwd=self.workspace_root,
-            capture_output=True,
-            text=True
+            self.workspace_root
         )
         
         if result.returncode != 0:
@@ -653,15 +1998,21 @@ class ToolExecutor:
     
     def _git_diff(self, cached: bool = False) -> str:
         """Get git diff."""
+        return self._cached_git(("diff", bool(cached)), lambda: self._compute_git_diff(cached))
+    
+    def _compute_git_diff(self, cached: bool) -> str:
+        """Run git diff without the cache."""
+        output = self._inprocess_git(self._libgit2_diff, cached)
+        if output is not None:
+            return output
+        
         cmd = ["git", "diff"]
         if cached:
             cmd.append("--cached")
         
-        result = subprocess.run(
+        result = _spawn(
             cmd,
-            cwd=self.workspace_root,
-            capture_output=True,
-            text=True
+            self.workspace_root
         )
         
         if result.returncode != 0:
@@ -672,34 +2023,102 @@ class ToolExecutor:
         
         return result.stdout
     
-    def _write_file(self, path: str, content: str) -> str:
-        """Write content to a file."""
+    def _write_file(self, path: str, content: Optional[str] = None, source: Optional[str] = None) -> str:
+        """Write content to a file, or copy it from another workspace file."""
         # SAFETY: Block writes to docker configuration files
         forbidden_patterns = ['docker-compose.yml', 'docker-compose.yaml', '/docker/', 'Dockerfile']
         for pattern in forbidden_patterns:
             if pattern in path:
                 return f"Error: Cannot write to {path} - Docker files are protected. Only edit files in todo-app/src/"
         
-        file_path = self.workspace_root / path
+        file_path = self._abs(path)
         
-        # Create parent directories if needed
-        file_path.parent.mkdir(parents=True, exist_ok=True)
+        # Create parent directories if needed (once per directory)
+        parent = os.path.dirname(file_path)
+        if parent and parent not in self._known_dirs:
+            os.makedirs(parent, exist_ok=True)
+            self._known_dirs.add(parent)
         
+        self._forget_reads(file_path)
         try:
-            file_path.write_text(content)
-            return f"Successfully wrote to {path}"
+            try:
+                return self._write_file_once(path, file_path, content, source)
+            except FileNotFoundError:
+                if not parent:
+                    raise
+                # Something removed the directory since it was recorded
+                self._known_dirs.discard(parent)
+                os.makedirs(parent, exist_ok=True)
+                self._known_dirs.add(parent)
+                return self._write_file_once(path, file_path, content, source)
         except Exception as e:
             return f"Error writing file: {str(e)}"
     
+    def _write_file_once(self, path: str, file_path: str, content: Optional[str],
+                         source: Optional[str]) -> str:
+        """One attempt at write_file's copy or write; OSErrors propagate."""
+        if source is not None:
+            source_path, st = self._resolve(source)
+            if st is None or not stat.S_ISREG(st.st_mode):
+                return f"Error: File not found: {source}"
+            # copyfile uses sendfile(2) on Linux, so the data never enters Python
+            shutil.copyfile(source_path, file_path)
+        elif content is None:
+            return "Error: write_file needs either content or source"
+        else:
+            data = content.encode("utf-8")
+            if self._same_content(file_path, data):
+                return f"Unchanged: {path} already has this content"
+            return self._write_content(path, file_path, data)
+        return f"Successfully wrote to {path}"
+    
+    def _same_content(self, file_path: str, data: bytes) -> bool:
+        """Whether file_path already holds exactly data."""
+        try:
+            st = os.stat(file_path)
+        except FileNotFoundError:
+            return False
+        if st.st_size != len(data) or not stat.S_ISREG(st.st_mode):
+            return False
+        
+        # A file we wrote and nobody touched since compares by digest alone
+        known = self._file_hashes.get(file_path)
+        if known is not None and known[:2] == (st.st_size, st.st_mtime_ns):
+            return known[2] == _content_digest(data)
+        with open(file_path, "rb") as f:
+            return f.read() == data
+    
+    def _write_content(self, path: str, file_path: str, data: bytes) -> str:
+        """Replace file_path's contents with data, atomically for regular files."""
+        try:
+            st = os.lstat(file_path)
+        except FileNotFoundError:
+            st = None
+        
+        if st is None or stat.S_ISREG(st.st_mode):
+            # The rename would swap out the inode, so carry the old mode over
+            _write_atomic(file_path, data, stat.S_IMODE(st.st_mode) if st else None)
+        else:
+            # Write through symlinks and special files in place
+            with open(file_path, "wb") as f:
+                f.write(data)
+        
+        st = os.stat(file_path)
+        self._file_hashes[file_path] = (st.st_size, st.st_mtime_ns, _content_digest(data))
+        return f"Successfully wrote to {path}"
+    
     def _apply_patch(self, patch: str) -> str:
         """Apply a unified diff patch."""
+        output = self._apply_patch_inprocess(patch)
+        if output is not None:
+            return output
+        
+        self._forget_reads()  # A patch may touch any number of files
         try:
-            result = subprocess.run(
+            result = _spawn(
                 ["git", "apply"],
+                self.workspace_root,
                 input=patch,
-                cwd=self.workspace_root,
-                capture_output=True,
-                text=True,
                 timeout=30
             )
             
@@ -710,27 +2129,96 @@ class ToolExecutor:
         except subprocess.TimeoutExpired:
             return "Error: Patch application timed out"
     
+    def _apply_patch_inprocess(self, patch: str) -> Optional[str]:
+        """
+        Apply a unified diff with whatthepatch, without spawning git.
+        
+        Every hunk is applied in memory before anything is written, so a
+        failure leaves the tree untouched. Returns None for anything this
+        path doesn't handle (renames, mode/binary changes, CRLF files, missing
+        trailing newlines, context mismatches) so the caller can defer to
+        git apply.
+        """
+        if "\\ No newline at end of file" in patch:
+            return None
+        whatthepatch = _lazy_import("whatthepatch")
+        if whatthepatch is None:
+            return None
+        
+        updates = {}
+        try:
+            for diff in whatthepatch.parse_patch(patch):
+                header = diff.header
+                if header is None or not diff.changes:
+                    return None
+                old_path, new_path = header.old_path, header.new_path
+                if old_path != new_path and "/dev/null" not in (old_path, new_path):
+                    return None
+                
+                rel_path = old_path if new_path == "/dev/null" else new_path
+                if os.path.isabs(rel_path) or ".." in Path(rel_path).parts:
+                    return None
+                target = self._abs(rel_path)
+                if target in updates:
+                    return None
+                
+                if old_path == "/dev/null":
+                    if os.path.exists(target):
+                        return None
+                    content = ""
+                else:
+                    with open(target) as f:
+                        content = f.read()
+                if "\r" in content or (content and not content.endswith("\n")):
+                    return None
+                
+                lines = content[:-1].split("\n") if content else []
+                new_lines = whatthepatch.apply_diff(diff, lines)
+                updates[target] = None if new_path == "/dev/null" else new_lines
+        except (whatthepatch.exceptions.WhatThePatchException, OSError, UnicodeDecodeError):
+            return None
+        
+        if not updates:
+            return None
+        
+        for target, new_lines in updates.items():
+            self._forget_reads(target)
+            if new_lines is None:
+                os.unlink(target)
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with open(target, "w") as f:
+                    f.write("\n".join(new_lines) + "\n" if new_lines else "")
+        return "Patch applied successfully"
+    
     def _run_cmd(self, command: str, cwd: str = ".") -> str:
         """Run a shell command with safety guardrails."""
         # Safety: Block obviously dangerous commands
-        dangerous_patterns = ["rm -rf /", "dd if=", "mkfs", "> /dev/"]
-        for pattern in dangerous_patterns:
-            if pattern in command.lower():
-                return f"Error: Command blocked for safety: {pattern}"
+        reason = _blocked_reason(command)
+        if reason:
+            return f"Error: Command blocked for safety: {reason}"
         
-        work_dir = self.workspace_root / cwd
-        if not work_dir.exists():
+        work_dir, st = self._resolve(cwd)
+        if st is None:
             return f"Error: Directory not found: {cwd}"
         
+        # Arbitrary commands can modify files behind our back
+        self._forget_reads()
+        
         try:
-            result = subprocess.run(
-                command,
-                shell=True,
-                cwd=work_dir,
-                capture_output=True,
-                text=True,
-                timeout=60
-            )
+            argv = _command_argv(command)
+            # Simple commands are already exec'd directly; only shell syntax
+            # benefits from the warm shell. Busy shell -> don't queue behind it.
+            warm = argv[0] == "/bin/sh" and self._shell is not None and not _BACKGROUND_RE.search(command)
+            if warm and self._shell.lock.acquire(blocking=False):
+                try:
+                    result = self._shell.run(command, work_dir, timeout=60)
+                except BrokenPipeError:
+                    result = _spawn(argv, work_dir, timeout=60)
+                finally:
+                    self._shell.lock.release()
+            else:
+                result = _spawn(argv, work_dir, timeout=60)
             
             output = ""
             if result.stdout:
@@ -747,38 +2235,41 @@ class ToolExecutor:
     
     def _mkdir(self, path: str) -> str:
         """Create a directory."""
-        dir_path = self.workspace_root / path
         try:
-            dir_path.mkdir(parents=True, exist_ok=True)
+            os.makedirs(self._abs(path), exist_ok=True)
             return f"Created directory: {path}"
         except Exception as e:
             return f"Error creating directory: {str(e)}"
     
     def _remove(self, path: str) -> str:
         """Remove a file or directory."""
-        target_path = self.workspace_root / path
-        
-        if not target_path.exists():
+        target_path = self._abs(path)
+        # lstat: a symlink is removed itself, never the directory it points to
+        try:
+            st = os.lstat(target_path)
+        except OSError:
             return f"Error: Path does not exist: {path}"
         
+        self._forget_reads()  # Could be a directory holding cached files
+        
         try:
-            if target_path.is_file():
-                target_path.unlink()
-                return f"Removed file: {path}"
-            elif target_path.is_dir():
-                import shutil
-                shutil.rmtree(target_path)
+            if stat.S_ISDIR(st.st_mode):
+                _fast_rmtree(target_path, st.st_dev)
                 return f"Removed directory: {path}"
+            os.unlink(target_path)
+            return f"Removed file: {path}"
         except Exception as e:
             return f"Error removing path: {str(e)}"
     
     def _git_checkout(self, branch: str) -> str:
         """Checkout a git branch."""
-        result = subprocess.run(
+        output = self._inprocess_git(self._libgit2_checkout, branch)
+        if output is not None:
+            return output
+        
+        result = _spawn(
             ["git", "checkout", branch],
-            cwd=self.workspace_root,
-            capture_output=True,
-            text=True
+            self.workspace_root
         )
         
         if result.returncode == 0:
@@ -788,23 +2279,23 @@ class ToolExecutor:
     
     def _git_create_branch(self, branch: str, from_ref: str = "main") -> str:
         """Create and checkout a new git branch."""
+        output = self._inprocess_git(self._libgit2_create_branch, branch, from_ref)
+        if output is not None:
+            return output
+        
         # First ensure we're on the from_ref
-        result = subprocess.run(
+        result = _spawn(
             ["git", "checkout", from_ref],
-            cwd=self.workspace_root,
-            capture_output=True,
-            text=True
+            self.workspace_root
         )
         
         if result.returncode != 0:
             return f"Error checking out {from_ref}: {result.stderr}"
         
         # Create and checkout new branch
-        result = subprocess.run(
+        result = _spawn(
             ["git", "checkout", "-b", branch],
-            cwd=self.workspace_root,
-            capture_output=True,
-            text=True
+            self.workspace_root
         )
         
         if result.returncode == 0:
@@ -814,23 +2305,23 @@ class ToolExecutor:
     
     def _git_commit_all(self, message: str) -> str:
         """Stage all changes and commit."""
+        output = self._inprocess_git(self._libgit2_commit_all, message)
+        if output is not None:
+            return output
+        
         # Stage all changes
-        result = subprocess.run(
+        result = _spawn(
             ["git", "add", "-A"],
-            cwd=self.workspace_root,
-            capture_output=True,
-            text=True
+            self.workspace_root
         )
         
         if result.returncode != 0:
             return f"Error staging changes: {result.stderr}"
         
         # Commit
-        result = subprocess.run(
+        result = _spawn(
             ["git", "commit", "-m", message],
-            cwd=self.workspace_root,
-            capture_output=True,
-            text=True
+            self.workspace_root
         )
         
         if result.returncode == 0:
@@ -843,11 +2334,17 @@ class ToolExecutor:
     
     def _git_current_branch(self) -> str:
         """Get the current git branch."""
-        result = subprocess.run(
+        output = self._inprocess_git(self._libgit2_current_branch)
+        if output is not None:
+            return output
+        
+        branch = self._head_branch()
+        if branch is not None:
+            return branch
+        
+        result = _spawn(
             ["git", "rev-parse", "--abbrev-ref", "HEAD"],
-            cwd=self.workspace_root,
-            capture_output=True,
-            text=True
+            self.workspace_root
         )
         
         if result.returncode == 0:
@@ -855,15 +2352,71 @@ class ToolExecutor:
         else:
             return f"Error getting current branch: {result.stderr}"
 
+    def _head_branch(self) -> Optional[str]:
+        """
+        Branch name read straight from .git/HEAD, re-parsed only when HEAD changes.
+        
+        Returns None when the workspace root isn't a plain repository root
+        (worktrees, subdirectories), leaving it to `git rev-parse`.
+        """
+        head_path = os.path.join(self._root_str, ".git", "HEAD")
+        try:
+            st = os.stat(head_path)
+        except OSError:
+            return None
+        
+        cached = self._head_cache
+        if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached[2]
+        
+        try:
+            with open(head_path, "rb") as f:
+                head = f.read().decode("utf-8").strip()
+        except (OSError, UnicodeDecodeError):
+            return None
+        if head.startswith("ref: refs/heads/"):
+            branch = head[len("ref: refs/heads/"):]
+        elif head.startswith("ref: "):
+            return None
+        else:
+            branch = "HEAD"  # Detached: HEAD holds a commit id
+        self._head_cache = (st.st_mtime_ns, st.st_size, branch)
+        return branch
+    
+    def _git_status_and_branch(self) -> Tuple[str, str]:
+        """git_status and git_current_branch results from one git CLI run."""
+        try:
+            result = _spawn(
+                ["git", "status", "--porcelain", "--branch"],
+                self.workspace_root
+            )
+        except Exception as e:
+            return f"Error executing git_status: {e}", f"Error executing git_current_branch: {e}"
+        
+        if result.returncode != 0:
+            return f"Error: {result.stderr}", f"Error getting current branch: {result.stderr}"
+        
+        # First line is "## <branch>[...<upstream>] [ahead N]", "## No commits
+        # yet on <branch>" or "## HEAD (no branch)" when detached
+        header, _, status = result.stdout.partition("\n")
+        branch = header[3:]
+        for prefix in ("No commits yet on ", "Initial commit on "):
+            if branch.startswith(prefix):
+                branch = branch[len(prefix):]
+        branch = branch.split("...", 1)[0].split(" ", 1)[0]
+        
+        status = status if status.strip() else "Working tree clean"
+        key = self._git_state_key()
+        if key is not None:
+            self._git_cache[("status",)] = (key, time.monotonic(), status)
+        return status, branch
+    
     def _run_tests(self, command: str) -> str:
         """Run tests or quality checks."""
         try:
-            result = subprocess.run(
-                command,
-                shell=True,
-                cwd=self.workspace_root,
-                capture_output=True,
-                text=True,
+            result = _spawn(
+                _command_argv(command),
+                self.workspace_root,
                 timeout=300  # 5 minute timeout for tests
             )
             
@@ -880,115 +2433,208 @@ class ToolExecutor:
         except subprocess.TimeoutExpired:
             return "Error: Tests timed out after 300 seconds"
 
-    def _update_prd(self, story_id: str, passes: bool, notes: str = "") -> str:
-        """Update a user story in prd.json."""
-        prd_path = self.workspace_root / "prd.json"
+    def _load_prd(self) -> Optional[tuple]:
+        """
+        The _prd_cache entry for prd.json, or None if it doesn't exist.
         
-        if not prd_path.exists():
-            return "Error: prd.json not found"
+        The entry is (mtime_ns, size, prd, by_id, queue). The parse is
+        reused until the file's mtime or size changes, so the per-iteration
+        get_next_story call costs one stat. Call with _prd_lock held and use
+        the returned entry rather than re-reading _prd_cache; callers that
+        modify the dict save it with _save_prd.
+        """
+        prd_path = self._prd_path
+        try:
+            st = os.stat(prd_path)
+        except FileNotFoundError:
+            return None
+        
+        cached = self._prd_cache
+        if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached
         
+        with open(prd_path, "rb") as f:
+            prd = json_loads(f.read())
+        # First occurrence wins for duplicate ids, as with a linear scan
+        by_id: Dict[Any, tuple] = {}
+        for position, story in enumerate(prd.get("userStories", [])):
+            by_id.setdefault(story.get("id"), (position, story))
+        entry = (st.st_mtime_ns, st.st_size, prd, by_id, None)
+        self._prd_cache = entry
+        return entry
+    
+    def _incomplete_stories(self, entry: tuple) -> Tuple[tuple, list]:
+        """
+        (priority, position, story) for every story with passes=false, sorted.
+        
+        Built on first use after each (re)parse of prd.json, then kept in
+        order by update_prd. Position breaks priority ties in file order,
+        like the stable sort it replaces. Takes the entry _load_prd returned
+        and returns it, updated to hold the queue, along with the queue.
+        Call with _prd_lock held.
+        """
+        mtime_ns, size, prd, by_id, queue = entry
+        if queue is None:
+            queue = sorted(
+                (story.get("priority", 999), position, story)
+                for position, story in enumerate(prd.get("userStories", []))
+                if not story.get("passes", False)
+            )
+            entry = (mtime_ns, size, prd, by_id, queue)
+            self._prd_cache = entry
+        return entry, queue
+    
+    def _save_prd(self, prd: Dict[str, Any]) -> None:
+        """Write prd.json and re-key the parsed-PRD cache to the new file."""
+        prd_path = self._prd_path
+        cached, self._prd_cache = self._prd_cache, None
         try:
-            prd = json.loads(prd_path.read_text())
+            mode = stat.S_IMODE(os.stat(prd_path).st_mode)
+        except FileNotFoundError:
+            mode = None
+        # Serialized once; readers see the old file or the new one, never a partial write
+        _write_atomic(prd_path, dump_pretty(prd), mode, durable=True)
+        st = os.stat(prd_path)
+        if cached is not None and cached[2] is prd:
+            self._prd_cache = (st.st_mtime_ns, st.st_size) + cached[2:]
+        self._forget_reads(prd_path)
+    
+    def _update_prd(self, story_id: str, passes: bool, notes: str = "") -> str:
+        """Update a user story in prd.json."""
+        with self._prd_lock:
+            try:
+                entry = self._load_prd()
+            except json.JSONDecodeError:
+                return "Error: Invalid JSON in prd.json"
+            if entry is None:
+                return "Error: prd.json not found"
+            prd = entry[2]
             
-            # Find and update the story
-            for story in prd.get("userStories", []):
-                if story.get("id") == story_id:
-                    story["passes"] = passes
-                    if notes:
-                        story["notes"] = notes
-                    
-                    # Write back
-                    prd_path.write_text(json.dumps(prd, indent=2))
-                    return f"Updated {story_id}: passes={passes}"
+            found = entry[3].get(story_id)
+            if found is None:
+                return f"Error: Story {story_id} not found in prd.json"
+            position, story = found
             
-            return f"Error: Story {story_id} not found in prd.json"
-        except json.JSONDecodeError:
-            return "Error: Invalid JSON in prd.json"
+            # Re-marking a story as it already is costs no serialize or write
+            if story.get("passes") is passes and (not notes or story.get("notes") == notes):
+                return f"Updated {story_id}: passes={passes}"
+            
+            # Keep get_next_story's queue in step instead of re-sorting
+            _, queue = self._incomplete_stories(entry)
+            key = (story.get("priority", 999), position)
+            index = bisect.bisect_left(queue, key)
+            queued = index < len(queue) and queue[index][1] == position
+            if passes and queued:
+                del queue[index]
+            elif not passes and not queued:
+                queue.insert(index, key + (story,))
+            
+            story["passes"] = passes
+            if notes:
+                story["notes"] = notes
+            
+            # Write back, unless a batch will write once at the end
+            if self._prd_batch_depth:
+                self._dirty_prd = prd
+                self._next_story_memo = None
+            else:
+                self._save_prd(prd)
+            return f"Updated {story_id}: passes={passes}"
 
     def _append_progress(self, story_id: str, summary: str, 
-                         files_changed: List[str] = None, learnings: str = "") -> str:
+                         files_changed: Optional[List[str]] = None, learnings: str = "") -> str:
         """Append progress entry to progress.txt."""
-        from datetime import datetime
+        progress_path = self._progress_path
         
-        progress_path = self.workspace_root / "progress.txt"
-        
-        entry = f"\n## {datetime.now().strftime('%Y-%m-%d %H:%M')} - {story_id}\n"
-        entry += f"Thread: local\n"
-        entry += f"- {summary}\n"
+        parts = [
+            f"\n## {_minute_stamp(int(time.time() // 60))} - {story_id}\n",
+            "Thread: local\n",
+            f"- {summary}\n",
+        ]
         
         if files_changed:
-            entry += f"- Files changed: {', '.join(files_changed)}\n"
+            parts.append(f"- Files changed: {', '.join(files_changed)}\n")
         
         if learnings:
-            entry += f"**Learnings for future iterations:**\n"
-            entry += f"  - {learnings}\n"
+            parts.append("**Learnings for future iterations:**\n")
+            parts.append(f"  - {learnings}\n")
         
-        entry += "---\n"
+        parts.append("---\n")
+        data = "".join(parts).encode("utf-8")
         
         try:
-            with open(progress_path, "a") as f:
-                f.write(entry)
+            # One O_APPEND write per entry: concurrent appends never interleave
+            fd = os.open(progress_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+            try:
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(fd, view):]
+            finally:
+                os.close(fd)
             return f"Appended progress for {story_id}"
         except Exception as e:
             return f"Error appending progress: {str(e)}"
 
     def _get_next_story(self) -> str:
         """Get the next user story to implement."""
-        prd_path = self.workspace_root / "prd.json"
-        
-        if not prd_path.exists():
-            return "Error: prd.json not found"
-        
         try:
-            prd = json.loads(prd_path.read_text())
-            
-            # Find stories where passes=false, sorted by priority
-            incomplete_stories = [
-                s for s in prd.get("userStories", [])
-                if not s.get("passes", False)
-            ]
-            
-            if not incomplete_stories:
-                return "ALL_STORIES_COMPLETE"
-            
-            # Sort by priority (lowest number = highest priority)
-            incomplete_stories.sort(key=lambda s: s.get("priority", 999))
-            
-            next_story = incomplete_stories[0]
-            
-            return json.dumps({
-                "id": next_story.get("id"),
-                "title": next_story.get("title"),
-                "description": next_story.get("description"),
-                "acceptanceCriteria": next_story.get("acceptanceCriteria", []),
-                "priority": next_story.get("priority"),
-                "remaining_stories": len(incomplete_stories) - 1
-            }, indent=2)
+            with self._prd_lock:
+                entry = self._load_prd()
+                if entry is None:
+                    return "Error: prd.json not found"
+                
+                # Every reparse or save replaces the cache entry, so identity
+                # says whether the last answer still holds
+                memo = self._next_story_memo
+                if memo is not None and memo[0] is entry:
+                    return memo[1]
+                
+                # Stories where passes=false, by priority (lowest number = highest priority)
+                entry, incomplete_stories = self._incomplete_stories(entry)
+                if not incomplete_stories:
+                    result = "ALL_STORIES_COMPLETE"
+                else:
+                    next_story = incomplete_stories[0][2]
+                    result = dump_pretty({
+                        "id": next_story.get("id"),
+                        "title": next_story.get("title"),
+                        "description": next_story.get("description"),
+                        "acceptanceCriteria": next_story.get("acceptanceCriteria", []),
+                        "priority": next_story.get("priority"),
+                        "remaining_stories": len(incomplete_stories) - 1
+                    }).decode("utf-8")
+                self._next_story_memo = (entry, result)
+                return result
         except json.JSONDecodeError:
             return "Error: Invalid JSON in prd.json"
 
     # Docker tools for DinD environment
     def _docker_build(self, tag: str, context: str, dockerfile: str = "Dockerfile") -> str:
         """Build a Docker image."""
-        context_path = self.workspace_root / context
-        if not context_path.exists():
+        context_path = os.path.abspath(self._abs(context))
+        if not self._exists_cached(context):
             return f"Error: Build context not found: {context}"
         
-        dockerfile_path = context_path / dockerfile
-        if not dockerfile_path.exists():
-            return f"Error: Dockerfile not found: {context}/{dockerfile}"
+        # A missing Dockerfile is left for docker to report; see _MISSING_DOCKERFILE_RE
+        dockerfile_path = os.path.join(context_path, dockerfile)
+        missing = f"Error: Dockerfile not found: {context}/{dockerfile}"
+        
+        output = self._docker_api(_api_docker_build, tag, context_path, dockerfile)
+        if output is not None:
+            return missing if _MISSING_DOCKERFILE_RE.search(output) else output
         
         try:
-            result = subprocess.run(
-                ["docker", "build", "-t", tag, "-f", str(dockerfile_path), str(context_path)],
-                cwd=self.workspace_root,
-                capture_output=True,
-                text=True,
-                timeout=600  # 10 minute timeout for builds
+            result = _spawn(
+                ["docker", "build", "-t", tag, "-f", dockerfile_path, context_path],
+                None,  # Paths are absolute; docker doesn't need a cwd
+                timeout=600,  # 10 minute timeout for builds
+                limit=DOCKER_OUTPUT_LIMIT
             )
             
             if result.returncode == 0:
-                return f"Successfully built image: {tag}\n{result.stdout[-500:] if len(result.stdout) > 500 else result.stdout}"
+                return f"Successfully built image: {tag}\n{result.stdout[-500:]}"
+            elif _MISSING_DOCKERFILE_RE.search(result.stderr):
+                return missing
             else:
                 return f"Docker build failed:\n{result.stderr}"
         except subprocess.TimeoutExpired:
@@ -998,28 +2644,28 @@ class ToolExecutor:
 
     def _docker_compose_up(self, compose_file: str, detach: bool = True, build: bool = False) -> str:
         """Start services with docker-compose."""
-        compose_path = self.workspace_root / compose_file
-        if not compose_path.exists():
+        compose_path = os.path.abspath(self._abs(compose_file))
+        if not self._exists_cached(compose_file):
             return f"Error: docker-compose file not found: {compose_file}"
         
-        cmd = ["docker", "compose", "-f", str(compose_path), "up"]
+        cmd = ["docker", "compose", "-f", compose_path, "up"]
         if detach:
             cmd.append("-d")
         if build:
             cmd.append("--build")
         
         try:
-            result = subprocess.run(
+            result = _spawn(
                 cmd,
-                cwd=self.workspace_root,
-                capture_output=True,
-                text=True,
-                timeout=300
+                None,
+                timeout=300,
+                limit=DOCKER_OUTPUT_LIMIT
             )
             
             output = result.stdout + result.stderr
             if result.returncode == 0:
-                return f"Docker compose up successful\n{output[-1000:] if len(output) > 1000 else output}"
+                self._active_compose = compose_path
+                return f"Docker compose up successful\n{output[-1000:]}"
             else:
                 return f"Docker compose up failed:\n{output}"
         except subprocess.TimeoutExpired:
@@ -1029,20 +2675,18 @@ class ToolExecutor:
 
     def _docker_compose_down(self, compose_file: str, volumes: bool = False) -> str:
         """Stop docker-compose services."""
-        compose_path = self.workspace_root / compose_file
-        if not compose_path.exists():
+        compose_path = os.path.abspath(self._abs(compose_file))
+        if not self._exists_cached(compose_file):
             return f"Error: docker-compose file not found: {compose_file}"
         
-        cmd = ["docker", "compose", "-f", str(compose_path), "down"]
+        cmd = ["docker", "compose", "-f", compose_path, "down"]
         if volumes:
             cmd.append("-v")
         
         try:
-            result = subprocess.run(
+            result = _spawn(
                 cmd,
-                cwd=self.workspace_root,
-                capture_output=True,
-                text=True,
+                None,
                 timeout=120
             )
             
@@ -1053,16 +2697,54 @@ class ToolExecutor:
         except subprocess.TimeoutExpired:
             return "Error: Docker compose down timed out"
 
+    def _compose_services(self, compose_path: str) -> Optional[List[str]]:
+        """Service names from a compose file, re-parsed only when it changes."""
+        yaml = _lazy_import("yaml")
+        if yaml is None:
+            return None
+        try:
+            st = os.stat(compose_path)
+        except OSError:
+            return None
+        cached = self._compose_cache.get(compose_path)
+        if cached is not None and cached[:2] == (st.st_mtime_ns, st.st_size):
+            return cached[2]
+        
+        try:
+            with open(compose_path, "rb") as f:
+                compose = yaml.safe_load(f)
+        except (OSError, yaml.YAMLError):
+            return None
+        services = sorted((compose or {}).get("services") or {}) if isinstance(compose, dict) else []
+        self._compose_cache[compose_path] = (st.st_mtime_ns, st.st_size, services)
+        return services
+    
+    def _container_hint(self, output: str) -> str:
+        """Append the running compose project's services to a missing-container error."""
+        if "No such container" not in output or self._active_compose is None:
+            return output
+        services = self._compose_services(self._active_compose)
+        if not services:
+            return output
+        compose_file = os.path.relpath(self._active_compose, self._root_str)
+        return (
+            f"{output.rstrip()}\nServices in {compose_file}: {', '.join(services)} "
+            f"(compose names containers <project>-<service>-<n>; see docker_ps)"
+        )
+    
     def _docker_exec(self, container: str, command: str) -> str:
         """Execute command in a container."""
+        result = self._docker_api(_api_docker_exec, container, command)
+        if isinstance(result, str):
+            return self._container_hint(result)
+        
         try:
-            result = subprocess.run(
-                ["docker", "exec", container, "sh", "-c", command],
-                cwd=self.workspace_root,
-                capture_output=True,
-                text=True,
-                timeout=120
-            )
+            if result is None:
+                result = _spawn(
+                    ["docker", "exec", container, "sh", "-c", command],
+                    None,
+                    timeout=120
+                )
             
             output = result.stdout
             if result.stderr:
@@ -1071,65 +2753,83 @@ class ToolExecutor:
             if result.returncode == 0:
                 return output if output else "Command completed successfully"
             else:
-                return f"Command failed (exit {result.returncode}):\n{output}"
+                return self._container_hint(f"Command failed (exit {result.returncode}):\n{output}")
         except subprocess.TimeoutExpired:
             return "Error: Docker exec timed out"
 
     def _docker_logs(self, container: str, tail: int = 100) -> str:
         """Get container logs."""
+        output = self._docker_api(_api_docker_logs, container, tail)
+        if output is None:
+            output = self._daemon_logs(container, tail)
+        if output is not None:
+            return self._container_hint(output)
+        
         try:
-            result = subprocess.run(
+            result = _spawn(
                 ["docker", "logs", "--tail", str(tail), container],
-                cwd=self.workspace_root,
-                capture_output=True,
-                text=True,
+                None,
                 timeout=30
             )
             
             output = result.stdout + result.stderr
+            if result.returncode != 0:
+                return self._container_hint(output)
             return output if output else "(no logs)"
         except subprocess.TimeoutExpired:
             return "Error: Docker logs timed out"
 
-    def _docker_ps(self, all_containers: bool = False) -> str:
+    def _docker_ps(self, all: bool = False) -> str:
         """List containers."""
-        cmd = ["docker", "ps", "--format", "table {{.Names}}\t{{.Status}}\t{{.Ports}}"]
-        if all_containers:
-            cmd.insert(2, "-a")
+        all = bool(all)
+        cached = self._ps_cache.get(all)
+        if cached is not None and time.monotonic() - cached[0] < DOCKER_PS_TTL:
+            return cached[1]
         
-        try:
-            result = subprocess.run(
-                cmd,
-                cwd=self.workspace_root,
-                capture_output=True,
-                text=True,
-                timeout=30
+        output = self._docker_api(_api_docker_ps, all)
+        if output is None:
+            # One JSON object per line parses exactly, unlike the padded table format
+            cmd = ["docker", "ps", "--format", "{{json .}}"]
+            if all:
+                cmd.insert(2, "-a")
+            try:
+                result = _spawn(
+                    cmd,
+                    None,
+                    timeout=30
+                )
+            except subprocess.TimeoutExpired:
+                return "Error: Docker ps timed out"
+            if result.returncode != 0:
+                return f"Error: {result.stderr}"
+            containers = [json_loads(line) for line in result.stdout.splitlines() if line.strip()]
+            output = _format_containers(
+                (c.get("Names", ""), c.get("Status", ""), c.get("Ports", "")) for c in containers
             )
-            
-            return result.stdout if result.stdout else "No containers running"
-        except subprocess.TimeoutExpired:
-            return "Error: Docker ps timed out"
+        
+        if not output.startswith("Error"):
+            self._ps_cache[all] = (time.monotonic(), output)
+        return output
 
-    def _docker_test(self, test_command: str, container: str = None) -> str:
+    def _docker_test(self, test_command: str, container: Optional[str] = None) -> str:
         """Run a test command in DinD environment."""
         try:
             if container:
                 # Run inside container
-                result = subprocess.run(
-                    ["docker", "exec", container, "sh", "-c", test_command],
-                    cwd=self.workspace_root,
-                    capture_output=True,
-                    text=True,
-                    timeout=120
-                )
+                result = self._docker_api(_api_docker_exec, container, test_command)
+                if isinstance(result, str):
+                    return result
+                if result is None:
+                    result = _spawn(
+                        ["docker", "exec", container, "sh", "-c", test_command],
+                        None,
+                        timeout=120
+                    )
             else:
                 # Run on host (for testing network connectivity to containers)
-                result = subprocess.run(
-                    test_command,
-                    shell=True,
-                    cwd=self.workspace_root,
-                    capture_output=True,
-                    text=True,
+                result = _spawn(
+                    _command_argv(test_command),
+                    self.workspace_root,
                     timeout=60
                 )
             
@@ -1143,3 +2843,7 @@ class ToolExecutor:
                 return f"TEST FAILED (exit {result.returncode})\n{output}"
         except subprocess.TimeoutExpired:
             return "Error: Test command timed out"
+
+
+# Tool name -> unbound ToolExecutor method; each tool is implemented by "_<name>"
+ToolExecutor._DISPATCH = {name: getattr(ToolExecutor, f"_{name}") for name in TOOL_NAMES}